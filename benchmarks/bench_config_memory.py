@@ -0,0 +1,116 @@
+"""
+Memory benchmark for the per-guild prefixes and user blacklist held by ConfigCache.
+
+Compares the old layout (a dict of every guild ID -> prefix string, and a set of blacklisted user IDs) with ConfigCache,
+which keeps only custom prefixes and stores IDs in SortedIntSets. Run from the repository root:
+
+    python -m benchmarks.bench_config_memory
+"""
+import random
+import tracemalloc
+from timeit import repeat
+
+from src.common.common import DEFAULT_PREFIX
+from src.common.guild_config import ConfigCache
+
+GUILDS = 100000
+USERS = 100000
+CUSTOM_RATIO = 0.03
+CUSTOM_PREFIXES = ["!", "?", "e!", "e>", ".", "$", "emoji ", ";;"]
+
+
+def snowflakes(rng: random.Random, count: int) -> list:
+    """ Random IDs in the range Discord uses, so none of them are cached small ints. """
+    return rng.sample(range(1 << 56, 1 << 60), count)
+
+
+def make_data(seed: int = 0):
+    """ (guild ID, prefix) pairs as they'd come back from MongoDB, and blacklisted user IDs. """
+    rng = random.Random(seed)
+
+    # Prefixes are decoded into a new string for every document, like pymongo does
+    prefixes = [
+        (
+            guild_id,
+            (
+                "".join(list(rng.choice(CUSTOM_PREFIXES)))
+                if rng.random() < CUSTOM_RATIO
+                else "".join(list(DEFAULT_PREFIX))
+            ),
+        )
+        for guild_id in snowflakes(rng, GUILDS)
+    ]
+
+    return prefixes, snowflakes(rng, USERS)
+
+
+def build_legacy(prefixes: list, blacklist: list):
+    return {guild_id: prefix for guild_id, prefix in prefixes}, set(blacklist)
+
+
+def build_compact(prefixes: list, blacklist: list) -> ConfigCache:
+    config = ConfigCache()
+
+    for guild_id, prefix in prefixes:
+        config._store_prefix(guild_id, prefix)
+
+    for user_id in blacklist:
+        config._blacklist.add(user_id)
+
+    return config
+
+
+def measure(build, *args) -> int:
+    """ The bytes still allocated by build() once it's returned. """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build(*args)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    del result
+    return after - before
+
+
+def bench_lookup(contains, ids: list, runs: int = 5) -> float:
+    """ The best time per lookup, in nanoseconds. """
+    best = min(repeat(lambda: [contains(i) for i in ids], number=1, repeat=runs))
+
+    return best / len(ids) * 1e9
+
+
+if __name__ == "__main__":
+    prefixes, blacklist = make_data()
+
+    legacy = measure(build_legacy, prefixes, blacklist)
+    compact = measure(build_compact, prefixes, blacklist)
+
+    print(
+        "%d guilds (%.0f%% custom prefixes), %d blacklisted users"
+        % (GUILDS, CUSTOM_RATIO * 100, USERS)
+    )
+    print("%-10s %12s" % ("layout", "memory"))
+    print("%-10s %10.1fMB" % ("legacy", legacy / 1024 / 1024))
+    print("%-10s %10.1fMB" % ("compact", compact / 1024 / 1024))
+    print("%-10s %11.1fx" % ("saving", legacy / compact))
+
+    # The blacklist is checked for every command, so check lookups haven't got meaningfully slower
+    legacy_prefixes, legacy_blacklist = build_legacy(prefixes, blacklist)
+    config = build_compact(prefixes, blacklist)
+    users = {
+        "blacklisted user": blacklist[:10000],
+        "other user": snowflakes(random.Random(1), 10000),
+    }
+
+    print()
+    print("%-22s %10s %10s" % ("lookup", "legacy", "compact"))
+
+    for name, ids in users.items():
+        print(
+            "%-22s %8.0fns %8.0fns"
+            % (
+                name,
+                bench_lookup(legacy_blacklist.__contains__, ids),
+                bench_lookup(config.is_blacklisted, ids),
+            )
+        )
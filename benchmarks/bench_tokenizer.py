@@ -0,0 +1,77 @@
+"""
+Micro-benchmark for the :emoji: pre-filter used by Emojis.replace_unparsed_emojis.
+
+Compares the old approach (re.search over the content, then split() and re.search per word) with find_emoji_tokens
+over a corpus of realistic chat messages. Run from the repository root:
+
+    python -m benchmarks.bench_tokenizer
+"""
+import random
+from re import search
+from timeit import repeat
+
+from src.common.tokens import find_emoji_tokens
+
+PLAIN = [
+    "lol",
+    "ok",
+    "good morning everyone",
+    "did anyone watch the game last night?",
+    "brb getting food",
+    "can someone help me with my homework, it's due tomorrow and I have no idea what I'm doing",
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "meeting moved to 14:30:00 tomorrow",
+    "that's hilarious <:kekw:749301838859337799>",
+    "<a:catjam:749301838859337799> <a:catjam:749301838859337799>",
+    "ratio",
+    "no way 😂😂😂",
+    "I think the answer is: it depends",
+]
+CANDIDATES = [
+    ":pogchamp:",
+    "this is so :pepehands:",
+    "gg :ez: :clap:",
+    "hello :wave::smile: how are you",
+    "not an emoji :doesnotexist: here",
+]
+
+
+def legacy(content: str) -> list:
+    """ The pre-filter replace_unparsed_emojis used before find_emoji_tokens. """
+    if not search(r":[a-zA-Z0-9_-]+:", content):
+        return []
+
+    return [w for w in content.split() if search(r":[a-zA-Z0-9_-]+:", w)]
+
+
+def make_corpus(size: int = 10000, candidate_ratio: float = 0.05) -> list:
+    """ A list of messages where roughly candidate_ratio of them contain an unparsed emoji. """
+    rng = random.Random(0)
+
+    return [
+        rng.choice(CANDIDATES if rng.random() < candidate_ratio else PLAIN)
+        for _ in range(size)
+    ]
+
+
+def bench(func, corpus: list, runs: int = 5) -> float:
+    """ The best time per message, in nanoseconds. """
+    best = min(repeat(lambda: [func(m) for m in corpus], number=1, repeat=runs))
+
+    return best / len(corpus) * 1e9
+
+
+if __name__ == "__main__":
+    corpora = {
+        "mixed (5% candidates)": make_corpus(),
+        "no candidates": [m for m in make_corpus() if not find_emoji_tokens(m)],
+        "all candidates": CANDIDATES * 2000,
+    }
+
+    print("%-24s %12s %12s %8s" % ("corpus", "legacy", "tokenizer", "speedup"))
+
+    for name, corpus in corpora.items():
+        old = bench(legacy, corpus)
+        new = bench(find_emoji_tokens, corpus)
+
+        print("%-24s %10.0fns %10.0fns %7.1fx" % (name, old, new, old / new))
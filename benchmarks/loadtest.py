@@ -0,0 +1,559 @@
+"""
+Offline load test for the message hot path: on_message -> invoke -> replace_unparsed_emojis, plus a few commands.
+
+Builds a real Emojis instance with every extension loaded, fills it with fake guilds, channels and emojis, and replays
+a configurable mix of synthetic messages through on_message. Nothing leaves the process: REST requests are answered
+by a local stand-in with a fixed latency, webhooks use a stand-in adapter, and MongoDB is an in-memory stand-in.
+Reports messages/sec, p50/p99 latency per kind of message, REST traffic, and memory growth. Run from the repository
+root:
+
+    python -m benchmarks.loadtest --messages 20000 --guilds 500 --rate 0
+    python -m benchmarks.loadtest --mix plain=0.5,emoji=0.4,unknown=0.05,command=0.05 --memory
+"""
+import argparse
+import asyncio
+import logging
+import random
+import resource
+import sys
+import tracemalloc
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from itertools import count
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+import discord
+from discord.webhook import AsyncWebhookAdapter
+
+import bot as bot_module
+from src.common import common
+
+NAMES = [
+    "pog",
+    "kekw",
+    "catjam",
+    "pepehands",
+    "monkas",
+    "sadge",
+    "clap",
+    "ez",
+    "wave",
+    "thonk",
+    "blobheart",
+    "partyparrot",
+]
+PLAIN = [
+    "lol",
+    "good morning everyone",
+    "did anyone watch the game last night?",
+    "meeting moved to 14:30:00 tomorrow",
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "can someone help me with my homework, it's due tomorrow and I have no idea what I'm doing",
+]
+COMMANDS = [">help", ">help upload", ">info {emoji}", ">emojify hello world"]
+
+# Fake snowflakes, starting well above small-int range
+snowflakes = count(700000000000000000)
+
+
+def timestamp() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def user_data(user_id: int, bot: bool = False) -> dict:
+    return {
+        "id": str(user_id),
+        "username": "user%d" % (user_id % 100000),
+        "discriminator": "0001",
+        "avatar": None,
+        "bot": bot,
+    }
+
+
+class FakeCollection:
+    """ An in-memory stand-in for the few Motor collection methods the bot uses. """
+
+    def __init__(self):
+        self.documents: List[dict] = []
+
+    @staticmethod
+    def _matches(document: dict, query: dict) -> bool:
+        for key, condition in query.items():
+            value = document.get(key)
+
+            if isinstance(condition, dict):
+                if "$gt" in condition and not (
+                    value is not None and value > condition["$gt"]
+                ):
+                    return False
+                if "$gte" in condition and not (
+                    value is not None and value >= condition["$gte"]
+                ):
+                    return False
+            elif value != condition:
+                return False
+
+        return True
+
+    async def find_one(self, query: dict, projection: dict = None):
+        return next((d for d in self.documents if self._matches(d, query)), None)
+
+    def find(self, query: dict, projection: dict = None):
+        async def results():
+            for document in [d for d in self.documents if self._matches(d, query)]:
+                yield document
+
+        return results()
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False) -> None:
+        document = await self.find_one(query)
+
+        if document is None:
+            if not upsert:
+                return
+
+            document = dict(query)
+            self.documents.append(document)
+
+        document.update(update.get("$set", {}))
+
+        for key, amount in update.get("$inc", {}).items():
+            document[key] = document.get(key, 0) + amount
+
+    async def replace_one(
+        self, query: dict, replacement: dict, upsert: bool = False
+    ) -> None:
+        await self.delete_one(query)
+        self.documents.append(dict(replacement))
+
+    async def delete_one(self, query: dict) -> None:
+        document = await self.find_one(query)
+
+        if document is not None:
+            self.documents.remove(document)
+
+    async def create_index(self, *args, **kwargs) -> None:
+        pass
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections: Dict[str, FakeCollection] = defaultdict(FakeCollection)
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        return self.collections[name]
+
+
+class FakeWebhookAdapter(AsyncWebhookAdapter):
+    """ Answers webhook executions locally after a fixed latency. """
+
+    def __init__(self, latency: float, requests: Counter):
+        super().__init__(session=None)
+        self.latency = latency
+        self.requests = requests
+
+    async def request(
+        self, verb, url, payload=None, multipart=None, *, files=None, reason=None
+    ):
+        self.requests["%s /webhooks/{webhook_id}/{webhook_token}" % verb] += 1
+        await asyncio.sleep(self.latency)
+
+
+class FakeRest:
+    """ Stands in for HTTPClient.request, answering the routes the hot paths use after a fixed latency. """
+
+    def __init__(self, bot, latency: float):
+        self.bot = bot
+        self.latency = latency
+        self.requests: Counter = Counter()
+
+    async def request(self, route, *, files=None, form=None, **kwargs):
+        name = "%s %s" % (route.method, route.path)
+        self.requests[name] += 1
+        await asyncio.sleep(self.latency)
+
+        if name == "POST /channels/{channel_id}/messages":
+            payload = kwargs.get("json", {})
+
+            return {
+                "id": str(next(snowflakes)),
+                "channel_id": str(route.channel_id),
+                "author": user_data(self.bot.user.id, bot=True),
+                "content": payload.get("content") or "",
+                "embeds": [payload["embed"]] if payload.get("embed") else [],
+                "attachments": [],
+                "mentions": [],
+                "mention_roles": [],
+                "mention_everyone": False,
+                "pinned": False,
+                "tts": False,
+                "type": 0,
+                "edited_timestamp": None,
+                "timestamp": timestamp(),
+            }
+        elif name == "GET /guilds/{guild_id}/emojis/{emoji_id}":
+            emoji_id = int(str(route.url).rsplit("/", 1)[-1])
+            emoji = self.bot.get_emoji(emoji_id)
+
+            return {
+                "id": str(emoji_id),
+                "name": emoji.name if emoji else "emoji",
+                "animated": False,
+                "require_colons": True,
+                "managed": False,
+                "roles": [],
+                "user": user_data(next(snowflakes)),
+            }
+
+        return None
+
+
+class LoadTest:
+    """ A bot full of fake guilds, and a generator of synthetic messages for them. """
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+
+        # MongoDB, before anything touches it
+        common.db._database = FakeDatabase()
+
+        self.bot = bot_module.create_bot()
+
+        # The pack catalogue would fetch from the internet
+        utility = self.bot.get_cog("Utility")
+
+        if utility is not None:
+            utility.packs_updater.cancel()
+
+        self.rest = FakeRest(self.bot, args.rest_latency / 1000)
+        self.bot.http.request = self.rest.request
+        self.bot.metrics.instrument_http(self.bot.http)
+        self.webhook_adapter = FakeWebhookAdapter(
+            args.rest_latency / 1000, self.rest.requests
+        )
+
+        if args.rest_rate:
+            self.bot.rest.rate = self.bot.rest._tokens = args.rest_rate
+
+        if args.no_limits:
+            # The modules read these when checking, so patching them lifts the budgets. load_extension executes
+            # custom_checks afresh, so patch the module the loaded cog actually uses
+            unlimited = (1e9, 1.0)
+            custom_checks = sys.modules["src.exts.custom_checks"]
+            custom_checks.GLOBAL_COOLDOWN = custom_checks.GUILD_COOLDOWN = unlimited
+            bot_module.GUILD_REPLACEMENT_COOLDOWN = unlimited
+
+        self.channels: List[discord.TextChannel] = []
+        self.emojis: Dict[int, List[discord.Emoji]] = {}
+        self.users = [next(snowflakes) for _ in range(args.users)]
+
+    async def setup(self) -> None:
+        """ Create the bot's user, the guilds, and a cached webhook for every channel. """
+        state = self.bot._connection
+        state.user = discord.ClientUser(
+            state=state, data=user_data(next(snowflakes), bot=True)
+        )
+
+        for _ in range(self.args.guilds):
+            guild_id = next(snowflakes)
+            owner_id = self.rng.choice(self.users)
+            data = {
+                "id": str(guild_id),
+                "name": "guild",
+                "owner_id": str(owner_id),
+                "member_count": 2,
+                "roles": [
+                    {
+                        "id": str(guild_id),
+                        "name": "@everyone",
+                        "permissions": str(discord.Permissions.all().value),
+                        "position": 0,
+                        "color": 0,
+                        "hoist": False,
+                        "managed": False,
+                        "mentionable": False,
+                    }
+                ],
+                "emojis": [
+                    {
+                        "id": str(next(snowflakes)),
+                        "name": name,
+                        "animated": False,
+                        "require_colons": True,
+                        "managed": False,
+                        "roles": [],
+                    }
+                    for name in self.rng.sample(NAMES, self.args.emojis_per_guild)
+                ],
+                "channels": [
+                    {
+                        "id": str(next(snowflakes)),
+                        "name": "general",
+                        "type": 0,
+                        "position": i,
+                        "permission_overwrites": [],
+                    }
+                    for i in range(self.args.channels_per_guild)
+                ],
+                "members": [
+                    {
+                        "user": user_data(state.user.id, bot=True),
+                        "roles": [],
+                        "joined_at": timestamp(),
+                    }
+                ],
+            }
+
+            guild = discord.Guild(data=data, state=state)
+            state._add_guild(guild)
+            await self.bot.on_guild_available(guild)
+
+            self.emojis[guild.id] = list(guild.emojis)
+
+            for channel in guild.text_channels:
+                self.channels.append(channel)
+                webhook = discord.Webhook.partial(
+                    next(snowflakes), "token", adapter=self.webhook_adapter
+                )
+                self.bot.webhook_cache.put(channel.id, webhook)
+
+    def make_message(self, kind: str) -> discord.Message:
+        """ A message of a kind: plain, emoji (known :emoji: tokens), unknown (unknown tokens) or command. """
+        channel = self.rng.choice(self.channels)
+        emojis = self.emojis[channel.guild.id]
+
+        if kind == "plain":
+            content = self.rng.choice(PLAIN)
+        elif kind == "emoji":
+            content = "%s :%s: %s" % (
+                self.rng.choice(PLAIN),
+                self.rng.choice(emojis).name,
+                (
+                    ":%s:" % self.rng.choice(emojis).name
+                    if self.rng.random() < 0.3
+                    else ""
+                ),
+            )
+        elif kind == "unknown":
+            content = "%s :doesnotexist%d:" % (
+                self.rng.choice(PLAIN),
+                self.rng.randrange(100),
+            )
+        else:
+            content = self.rng.choice(COMMANDS).format(emoji=self.rng.choice(emojis))
+
+        author_id = self.rng.choice(self.users)
+
+        return discord.Message(
+            state=self.bot._connection,
+            channel=channel,
+            data={
+                "id": str(next(snowflakes)),
+                "channel_id": str(channel.id),
+                "author": user_data(author_id),
+                "member": {"roles": [], "joined_at": timestamp()},
+                "content": content,
+                "embeds": [],
+                "attachments": [],
+                "mentions": [],
+                "mention_roles": [],
+                "mention_everyone": False,
+                "pinned": False,
+                "tts": False,
+                "type": 0,
+                "edited_timestamp": None,
+                "timestamp": timestamp(),
+            },
+        )
+
+    def make_messages(self, count_: int) -> List[Tuple[str, discord.Message]]:
+        kinds, weights = zip(*self.args.mix.items())
+
+        return [
+            (kind, self.make_message(kind))
+            for kind in self.rng.choices(kinds, weights, k=count_)
+        ]
+
+    async def replay(
+        self, messages: List[Tuple[str, discord.Message]]
+    ) -> Tuple[float, Dict[str, List[float]]]:
+        """
+        Send messages through on_message, at most concurrency at once and at up to rate per second.
+
+        :return: The seconds taken, and the latencies for each kind of message.
+        """
+        latencies: Dict[str, List[float]] = defaultdict(list)
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        started = perf_counter()
+
+        async def handle(kind: str, message: discord.Message) -> None:
+            try:
+                start = perf_counter()
+                await self.bot.on_message(message)
+                latencies[kind].append(perf_counter() - start)
+            except Exception as err:
+                latencies["error: %s" % type(err).__name__].append(0.0)
+            finally:
+                semaphore.release()
+
+        tasks = []
+
+        for i, (kind, message) in enumerate(messages):
+            await semaphore.acquire()
+
+            if self.args.rate:
+                delay = started + i / self.args.rate - perf_counter()
+
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            tasks.append(asyncio.ensure_future(handle(kind, message)))
+
+        await asyncio.gather(*tasks)
+
+        return perf_counter() - started, latencies
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+
+    for part in text.split(","):
+        kind, weight = part.split("=")
+        mix[kind.strip()] = float(weight)
+
+    return mix
+
+
+async def main(args) -> None:
+    test = LoadTest(args)
+    await test.setup()
+
+    # Warm up caches and code paths, then measure from a clean slate
+    await test.replay(test.make_messages(min(1000, args.messages // 10)))
+    test.rest.requests.clear()
+    messages = test.make_messages(args.messages)
+
+    if args.memory:
+        tracemalloc.start()
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    memory_before = tracemalloc.get_traced_memory()[0] if args.memory else 0
+
+    elapsed, latencies = await test.replay(messages)
+
+    # Let replacements that were queued behind the REST budget finish or be shed
+    await asyncio.sleep(0.1)
+
+    memory_after = tracemalloc.get_traced_memory()[0] if args.memory else 0
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(
+        "%d messages, %d guilds, %d channels, %.0fms fake REST latency"
+        % (args.messages, args.guilds, len(test.channels), args.rest_latency)
+    )
+    print("throughput: %.0f messages/sec" % (args.messages / elapsed))
+    print()
+    print("%-16s %8s %10s %10s %10s" % ("kind", "count", "p50", "p99", "max"))
+
+    for kind, values in sorted(latencies.items()):
+        print(
+            "%-16s %8d %8.2fms %8.2fms %8.2fms"
+            % (
+                kind,
+                len(values),
+                percentile(values, 0.5) * 1000,
+                percentile(values, 0.99) * 1000,
+                max(values) * 1000,
+            )
+        )
+
+    print()
+    print("REST requests:")
+
+    for route, requests in test.rest.requests.most_common():
+        print("%8d %s" % (requests, route))
+
+    rest_stats = test.bot.rest.stats()
+    print()
+    print(
+        "REST queue: replacement shed %d, replacement wait p99 %.1fms, command wait p99 %.1fms"
+        % (
+            rest_stats["replacement.shed"],
+            rest_stats["replacement.wait_p99"] * 1000,
+            rest_stats["command.wait_p99"] * 1000,
+        )
+    )
+    memo = test.bot.replacement_cache.stats()
+    print(
+        "Replacement memo: %.1f%% hits, %d tokens in %d guilds"
+        % (memo["hit_ratio"] * 100, memo["size"], memo["guilds"])
+    )
+    print("Peak RSS growth: %.1fMB" % ((rss_after - rss_before) / 1024))
+
+    if args.memory:
+        print(
+            "Traced memory growth: %.1fMB"
+            % ((memory_after - memory_before) / 1024 / 1024)
+        )
+
+        for stat in tracemalloc.take_snapshot().statistics("lineno")[:10]:
+            print("  %s" % stat)
+
+    # The bot's background tasks never finish on their own
+    for task in asyncio.all_tasks():
+        if task is not asyncio.current_task():
+            task.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--guilds", type=int, default=500)
+    parser.add_argument("--channels-per-guild", type=int, default=5)
+    parser.add_argument("--emojis-per-guild", type=int, default=8)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default="plain=0.80,emoji=0.14,unknown=0.04,command=0.02",
+        help="Weights for each kind of message: plain, emoji, unknown and command.",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=0, help="Messages/sec, 0 for as fast as possible."
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=200, help="Messages in flight at once."
+    )
+    parser.add_argument(
+        "--rest-latency",
+        type=float,
+        default=20.0,
+        help="Milliseconds per fake REST request.",
+    )
+    parser.add_argument(
+        "--rest-rate",
+        type=float,
+        default=0,
+        help="Override the REST scheduler's requests/sec.",
+    )
+    parser.add_argument(
+        "--no-limits",
+        action="store_true",
+        help="Disable per-user and per-guild cooldowns.",
+    )
+    parser.add_argument(
+        "--memory", action="store_true", help="Trace allocations (slower)."
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    asyncio.get_event_loop().run_until_complete(main(arguments))
@@ -1,15 +1,19 @@
+from time import perf_counter
+
+STARTED_AT = perf_counter()  # Before anything else is imported, for the startup report
+
 import asyncio
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from os import listdir
 from os.path import splitext
-from re import search
 
-import matplotlib.pyplot as plt
 from dateutil.utils import today
 from discord import (
     Activity,
     ActivityType,
-    Message,
     Intents,
     AllowedMentions,
     HTTPException,
@@ -19,16 +23,38 @@ from discord.ext.commands import (
     MissingRequiredArgument,
     CommandInvokeError,
     AutoShardedBot,
-    EmojiConverter,
-    BucketType,
-    CooldownMapping,
 )
 
+from src.common.bulk_import import UploadQueue
+from src.common.cluster import ClusterClient
 from src.common.common import *
+from src.common.cooldowns import CooldownStore, GUILD_REPLACEMENT_COOLDOWN
+from src.common.emoji_index import EmojiIndex
+from src.common.fetch import Fetcher
+from src.common.guild_config import ConfigCache
+from src.common.image_cache import ImageCache
+from src.common.metrics import Metrics
+from src.common.provisioning import WebhookProvisioner
+from src.common.replacement_cache import ReplacementCache
+from src.common.rest import BULK, REPLACEMENT, Overloaded, RestScheduler
+from src.common.search_index import EmojiSearchIndex
+from src.common.startup import StartupTimer
+from src.common.tokens import find_emoji_tokens
+from src.common.transcode import MAX_SOURCE_SIZE, fit_emoji, needs_transcoding
+from src.common.usage_graph import UsageGraph
+from src.common.watchdog import LoopWatchdog
+from src.common.webhook_cache import WebhookCache
+
+IMPORTED_AT = perf_counter()
 
 log = logging.Logger(__name__)
 
-GLOBAL_COOLDOWN = (1.0, 5.0)  # (1.0, 5.0) = 1 command per 5 seconds
+MAX_CONCURRENT_DOWNLOADS = 8  # Image downloads in flight at once, across the whole bot
+REST_RATE = 40.0  # Requests/sec for the whole bot. Discord allows 50 per token, shared by every cluster
+TRANSCODE_WORKERS = 2  # Processes used to shrink images that are too big to upload
+FLUSH_USAGE_ON_CLOSE = True  # Write pending command usage to MongoDB on shutdown
+LOOP_WATCHDOG = False  # Log the stack of anything blocking the event loop. Can be toggled with >watchdog
+LOOP_WATCHDOG_THRESHOLD = 0.25  # Seconds the loop can be blocked before it's logged
 WELCOME_MSG = (
     "Thanks for inviting Emojis. My prefix is `>`.\n\n"
     "%s **Important: [Read about getting started](https://github.com/passivity/emojis/blob/master/README.md)**."
@@ -63,22 +89,23 @@ class CustomContext(Context):
         Upload a custom emoji to a guild.
 
         :param name: The name for the emoji.
-        :param url: The source of the image. Must be < 256kb.
+        :param url: The source of the image. Images over 256kb are shrunk to fit.
         :param post_success: [Optional] Whether or not to post a success message in the chat.
         :returns: The new emoji.
         """
-        response = get(url)
-
-        if response.ok:
-            # Store the image in BytesIO to avoid saving to disk
-            emoji_bytes = BytesIO(response.content)
-
-            # Upload the emoji to the Guild
-            new_emoji = await self.guild.create_custom_emoji(
-                name=name, image=emoji_bytes.read()
+        # Download (and shrink, if needed) without blocking the event loop
+        with self.bot.metrics.timer("upload_emoji_seconds", stage="download"):
+            emoji_bytes = await self.bot.fetch_emoji_image(url)
+
+        # Upload the emoji to the Guild
+        with self.bot.metrics.timer("upload_emoji_seconds", stage="upload"):
+            new_emoji = await self.bot.rest.call(
+                "emojis:%d" % self.guild.id,
+                COMMAND,
+                self.guild.create_custom_emoji,
+                name=name,
+                image=emoji_bytes,
             )
-        else:
-            raise Exception("Couldn't fetch image (%s)." % response.status_code)
 
         # Post a success Embed in the chat
         if post_success:
@@ -95,17 +122,43 @@ class CustomContext(Context):
 class Emojis(AutoShardedBot):
     """ A custom AutoShardedBot class with overridden methods."""
 
-    def __init__(self):
-        self.cooldown = CooldownMapping.from_cooldown(*GLOBAL_COOLDOWN, BucketType.user)
+    def __init__(self, cluster: ClusterClient = None, **options):
+        """
+        :param cluster: [Optional] The connection to the other clusters, when run by cluster.py.
+        :param options: [Optional] Options for AutoShardedBot, e.g. shard_ids and shard_count.
+        """
+        self.cluster = cluster
+        self.startup_timer = StartupTimer(STARTED_AT)
+        self.startup_timer.timings["imports"] = IMPORTED_AT - STARTED_AT
+        self.cooldowns = CooldownStore()
+        self.rest = RestScheduler(
+            rate=max(1.0, REST_RATE * len(cluster.shard_ids) / cluster.shard_count)
+            if cluster is not None
+            else REST_RATE
+        )
         self.command_usage = {}
-        self.prefixes = {}
-        self.blacklist = set()
+        self.metrics = Metrics(
+            labels={"cluster": str(cluster.id)} if cluster is not None else None
+        )
+        self.config = ConfigCache()
+        self.emoji_index = EmojiIndex()
+        self.replacement_cache = ReplacementCache(self.emoji_index)
+        self.search_index = EmojiSearchIndex()
+        self.webhook_cache = WebhookCache()
+        self.webhook_provisioner = WebhookProvisioner(self)
+        self.fetcher = Fetcher(max_concurrent=MAX_CONCURRENT_DOWNLOADS)
+        self.image_cache = ImageCache()
+        self.usage_graph = UsageGraph()
+        self.transcode_pool = self._new_transcode_pool()
+        self.upload_queue = UploadQueue(self)
 
         # Make sure the bot can't be abused to mass ping
         allowed_mentions = AllowedMentions(roles=False, everyone=False, users=True)
 
         # Minimum required
-        intents = Intents(guilds=True, emojis=True, messages=True, reactions=True)
+        intents = Intents(
+            guilds=True, emojis=True, messages=True, reactions=True, webhooks=True
+        )
 
         super().__init__(
             command_prefix=self.get_prefix,
@@ -123,29 +176,169 @@ class Emojis(AutoShardedBot):
                 554275447710548018,  # ruby
                 686941073792303157,  # Kaki
             ],
+            **options,
         )
 
+        # Time REST requests and MongoDB commands, and export the other components' stats
+        self.metrics.instrument_http(self.http)
+        db.listeners.append(self.metrics.mongo_listener)
+        self.metrics.add_source("webhook_cache", self.webhook_cache.stats)
+        self.metrics.add_source("image_cache", self.image_cache.stats)
+        self.metrics.add_source("replacement_cache", self.replacement_cache.stats)
+        self.metrics.add_source("cooldowns", self.cooldowns.stats)
+        self.metrics.add_source("rest_queue", self.rest.stats)
+
+        self.watchdog = LoopWatchdog(
+            self.loop, LOOP_WATCHDOG_THRESHOLD, metrics=self.metrics
+        )
+
+        if LOOP_WATCHDOG:
+            self.watchdog.start()
+
         # Update continuously
         self.presence_updater = self.loop.create_task(self._bg_update_presence())
         self.usage_updater = self.loop.create_task(self._bg_update_usage())
 
-        # Update once
-        self.loop.create_task(self.update_prefix_list())
-        self.loop.create_task(self.update_blacklist())
+        self.config_updater = self.loop.create_task(self.config.run())
+        self.cooldown_sweeper = self.loop.create_task(self.cooldowns.run())
+        self.metrics_updater = self.loop.create_task(
+            self.metrics.run(
+                path="./data/stats/metrics-cluster%d.prom" % cluster.id
+                if cluster is not None
+                else "./data/stats/metrics.prom"
+            )
+        )
+
+        if cluster is not None:
+            cluster.attach(self)
+
+    async def close(self) -> None:
+        if FLUSH_USAGE_ON_CLOSE:
+            try:
+                await self.flush_usage()
+            except Exception as err:
+                log.error("Couldn't flush command usage on close: %s", err)
+
+        await self.fetcher.close()
+        self.transcode_pool.shutdown(wait=False)
+        self.watchdog.stop()
+
+        await super().close()
+
+    def owns_guild(self, guild_id: int) -> bool:
+        """ Whether a guild is on one of this process's shards. Always true unless the shards are split up. """
+        return (
+            self.shard_ids is None
+            or (guild_id >> 22) % self.shard_count in self.shard_ids
+        )
+
+    async def fetch_emoji_image(self, url) -> bytes:
+        """
+        Download an image, and shrink it if it's too big to be an emoji.
+
+        The format and dimensions are checked from the header first, so unsupported files fail without being decoded.
+        Resizing happens in transcode_pool, away from the event loop. Both the download and the shrunk copy are kept in
+        image_cache, so popular emojis are only fetched and resized once.
+
+        :param url: The source of the image.
+        :return: An image that can be uploaded as an emoji.
+        """
+        data, digest = await self.fetch_cached(url, MAX_SOURCE_SIZE)
+
+        return await self.prepare_emoji_image(data, digest)
+
+    async def fetch_cached(self, url, max_size: int) -> Tuple[bytes, str]:
+        """
+        Download a file through image_cache.
+
+        :param url: The URL of the file.
+        :param max_size: The maximum number of bytes to accept.
+        :return: The file, and the hash of its contents.
+        """
+        url = str(url)
+        digest = self.image_cache.url_digest(url)
+        data = await self.image_cache.get(digest) if digest else None
+
+        if data is None:
+            data = await self.fetcher.fetch(url, max_size=max_size)
+            digest = await self.image_cache.put_url(url, data)
+
+        return data, digest
+
+    async def prepare_emoji_image(self, data: bytes, digest: str = None) -> bytes:
+        """
+        Shrink an image if it's too big to be an emoji.
+
+        :param data: The image.
+        :param digest: [Optional] The hash of the image in image_cache, if it's already there.
+        :return: An image that can be uploaded as an emoji.
+        """
+        if not needs_transcoding(data):
+            return data
+
+        if digest is None:
+            digest = await self.image_cache.put(data)
+
+        fitted = await self.image_cache.get(digest, "emoji")
+
+        if fitted is None:
+            pool = self.transcode_pool
+
+            try:
+                fitted = await self.loop.run_in_executor(pool, fit_emoji, data)
+            except BrokenProcessPool:
+                # A worker died, e.g. killed for using too much memory, which breaks the whole pool. Replace it so
+                # later images can still be shrunk, unless another failed call already has
+                if pool is self.transcode_pool:
+                    log.error("A transcode worker died, restarting the pool.")
+                    self.transcode_pool = self._new_transcode_pool()
+                    pool.shutdown(wait=False)
+
+                raise Exception("Couldn't shrink that image, try a smaller one.")
+
+            await self.image_cache.put(fitted, digest, "emoji")
+
+        return fitted
+
+    @staticmethod
+    def _new_transcode_pool() -> ProcessPoolExecutor:
+        """ Start worker processes for shrinking images. """
+        # Spawned, not forked, so workers don't inherit the bot's sockets, or locks other threads hold mid-fork
+        return ProcessPoolExecutor(
+            max_workers=TRANSCODE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    async def prefetch_emoji_image(self, url) -> None:
+        """ Fetch an image into image_cache ahead of time, ignoring errors. """
+        try:
+            await self.fetch_emoji_image(url)
+        except Exception:
+            pass
 
     async def get_prefix(self, message):
-        return self.prefixes.get(message.guild.id, ">")
+        return await self.config.get_prefix(message.guild and message.guild.id)
 
     async def get_context(self, message, *, cls=CustomContext):
         """ Use CustomContext instead of Context. """
         return await super().get_context(message, cls=cls)
 
     async def on_message(self, message) -> None:
-        # Process message
-        await self.process_commands(message)
+        if message.author.bot:
+            return
+
+        with self.metrics.timer("listener_seconds", listener="on_message"):
+            # Build the context once, for both commands and emoji replacement
+            ctx = await self.get_context(message)
+
+            # Process message
+            await self.invoke(ctx)
 
-        # Replace unparsed :emojis:, NQN-style
-        await self.replace_unparsed_emojis(message)
+            # Replace unparsed :emojis:, NQN-style
+            with self.metrics.timer(
+                "listener_seconds", listener="replace_unparsed_emojis"
+            ):
+                await self.replace_unparsed_emojis(ctx)
 
     async def on_command_error(self, ctx, err) -> None:
         """
@@ -178,18 +371,84 @@ class Emojis(AutoShardedBot):
         await ctx.error(msg)
 
     async def invoke(self, ctx):
-        if ctx.message.author.id in self.blacklist:
+        # Most messages aren't commands, so only check the blacklist once one has been found
+        if ctx.command is None:
+            await super().invoke(ctx)
+        elif self.config.is_blacklisted(ctx.message.author.id):
             await ctx.error("You're blacklisted. ")
         else:
-            await super().invoke(ctx)
+            with self.metrics.timer(
+                "command_seconds", command=ctx.command.qualified_name
+            ):
+                await super().invoke(ctx)
 
     async def on_command_completion(self, ctx):
         cmd = ctx.command.name.lower()
 
         self.command_usage[cmd] = self.command_usage.get(cmd, 0) + 1
+        self.metrics.increment("commands_completed", command=cmd)
+
+    def update_emojis(self, guild_id: int, emojis: Iterable[Emoji]) -> None:
+        """
+        Replace a guild's emojis in the emoji indexes, and forget what its :emoji: tokens resolved to.
+
+        :param guild_id: The ID of the Guild.
+        :param emojis: Every emoji the Guild has.
+        """
+        self.emoji_index.update_guild(guild_id, emojis)
+        self.search_index.update_guild(guild_id, emojis)
+        self.replacement_cache.invalidate_guild(guild_id)
+
+    def remove_emojis(self, guild_id: int) -> None:
+        """ Remove a guild's emojis from the emoji indexes. """
+        self.emoji_index.remove_guild(guild_id)
+        self.search_index.remove_guild(guild_id)
+        self.replacement_cache.invalidate_guild(guild_id)
+
+    async def on_guild_available(self, guild) -> None:
+        self.update_emojis(guild.id, guild.emojis)
+
+    async def on_guild_unavailable(self, guild) -> None:
+        self.remove_emojis(guild.id)
+
+    async def on_guild_remove(self, guild) -> None:
+        self.remove_emojis(guild.id)
+
+    async def on_guild_emojis_update(self, guild, before, after) -> None:
+        """ Keep the emoji indexes in sync with emoji uploads, deletions and renames. """
+        self.update_emojis(guild.id, after)
+
+    async def on_webhooks_update(self, channel) -> None:
+        """
+        A webhook in the channel was created, edited or deleted, so the cached one may be stale.
+
+        The bot's own webhook creations cause this event too, sometimes after the new webhook is cached, so they're
+        ignored. Otherwise the channel is checked, and the cached webhook is only dropped if it's gone.
+        """
+        cached = self.webhook_cache.peek(channel.id)
+
+        if cached is None or self.webhook_cache.recently_created(channel.id):
+            return
+
+        try:
+            webhooks = await self.rest.call(
+                "webhooks:%d" % channel.id, BULK, channel.webhooks
+            )
+        except HTTPException:
+            self.webhook_cache.invalidate(channel.id)
+            return
+
+        if all(webhook.id != cached.id for webhook in webhooks):
+            self.webhook_cache.invalidate(channel.id)
 
     async def on_guild_join(self, guild) -> None:  # noqa
-        """ Send a welcome message, and create the Emojis webhook in each channel. """
+        """
+        Send a welcome message.
+
+        Webhooks aren't created here: each channel gets one when it first needs it, or all at once for guilds that opt
+        in with >webhooks.
+        """
+        self.update_emojis(guild.id, guild.emojis)
 
         # Find the first channel the bot can type in and send the welcome message
         for channel in guild.text_channels:
@@ -197,23 +456,24 @@ class Emojis(AutoShardedBot):
                 await channel.send(embed=Embed(description=WELCOME_MSG))
                 break
 
-        for channel in guild.text_channels:
-            await channel.create_webook(name="Emojis")
-
     async def on_ready(self) -> None:  # noqa
         print("Bot ready!")
 
-    async def update_blacklist(self):
-        query = db.blacklist.find({}, {"_id": False})
+        # on_ready fires again after reconnects, only run this the first time
+        if "on_ready" not in self.startup_timer.timings:
+            self.startup_timer.mark("on_ready")
+            print(self.startup_timer.report())
 
-        async for result in query:
-            self.blacklist.add(result["id"])
+            # Pick up bulk imports that were interrupted by the last restart
+            self.loop.create_task(self.upload_queue.resume())
 
-    async def update_prefix_list(self):
-        query = db.prefixes.find({}, {"_id": False})
+            # Warm the webhook cache for guilds that opted in to provisioning
+            self.loop.create_task(self.webhook_provisioner.resume())
 
-        async for result in query:
-            self.prefixes[result["id"]] = result["prefix"]
+            try:
+                self.startup_timer.save()
+            except OSError as err:
+                log.error("Couldn't save startup timings: %s", err)
 
     async def _bg_update_presence(self, delay: int = 300) -> None:
         """ Update the bot's status continuously. """
@@ -240,93 +500,101 @@ class Emojis(AutoShardedBot):
         await self.wait_until_ready()
 
         while not self.is_closed():
-            # Update all-time usage data
-            for cmd, usage in self.command_usage.items():
-                # Update global command usage
-                await db.usage.update_one(
-                    {}, {"$inc": {cmd.lower(): usage}}, upsert=True
-                )
-
-                # Update today's command usage
-                await db.historical_usage.update_one(
-                    {"date": str(today().strftime("%Y-%m-%d"))},
-                    {"$inc": {"commands": usage}},
-                    upsert=True,
-                )
-
-            # Reset command usage cache
-            self.command_usage = {}
-
-            await make_graph()
+            try:
+                await self.flush_usage()
+            except Exception as err:
+                log.error("Couldn't flush command usage: %s", err)
+
+            try:
+                await self.usage_graph.refresh(db.historical_usage)
+            except Exception as err:
+                log.error("Couldn't update the usage graph: %s", err)
+
             await asyncio.sleep(delay)
 
-    async def replace_unparsed_emojis(self, message: Message):
+    async def flush_usage(self) -> None:
+        """
+        Write the in-memory command usage to MongoDB: one $inc for the all-time totals, and one upsert for today.
+
+        The counters are swapped out before anything is awaited, so commands completed during the flush are kept for
+        the next one.
+        """
+        usage, self.command_usage = self.command_usage, {}
+
+        if not usage:
+            return
+
+        try:
+            await db.usage.update_one({}, {"$inc": usage}, upsert=True)
+        except Exception:
+            # Nothing was written, so put the counts back to be retried
+            for cmd, count in usage.items():
+                self.command_usage[cmd] = self.command_usage.get(cmd, 0) + count
+
+            raise
+
+        await db.historical_usage.update_one(
+            {"date": today().strftime("%Y-%m-%d")},
+            {"$inc": {"commands": sum(usage.values())}},
+            upsert=True,
+        )
+
+    async def replace_unparsed_emojis(self, ctx: CustomContext) -> None:
         """
         Replace unparsed ':emojis:' in a message, to simulate Discord Nitro.
         Sends the modified message on a Webhook that looks like the user.
         """
-        has_updated = False
-
-        if not message.author.bot:
-            # Check for :emojis:
-            match = bool(search(r":[a-zA-Z0-9_-]+:", message.content))
-
-            if match:
-                ctx = await self.get_context(message)
-                message_split = message.content.split()
-
-                # Loop through every word and try to make it an emoji
-                for i in range(len(message_split)):
-                    word = message_split[i]
-
-                    # Matches unparsed emojis
-                    if search(r":[a-zA-Z0-9_-]+:", word):
-                        try:
-                            # Convert to Emoji
-                            found_emoji = await EmojiConverter().convert(
-                                ctx, word.replace(":", "")
-                            )
-
-                            message_split[i] = str(found_emoji)
-                            has_updated = True
-                        except BadArgument:
-                            pass
-
-                if has_updated:
-                    # Find the bot's Webhook and send the message on it
-                    webhook = await get_emojis_webhook(ctx)
-
-                    await webhook.send(
-                        " ".join(message_split),
-                        username=message.author.display_name,
-                        avatar_url=message.author.avatar_url,
-                    )
+        message = ctx.message
 
-                    await message.delete()
+        # Check for :emojis:
+        tokens = find_emoji_tokens(message.content)
 
+        if not tokens or message.guild is None:
+            return
 
-async def make_graph():
-    """ Make a graph of command usage. """
-    query = db.historical_usage.find({}, {"_id": False})
+        content = message.content
+        parts = []
+        last_end = 0
 
-    dates = []
-    commands = []
+        # Swap each token that names a known emoji, leaving everything else untouched
+        for token in tokens:
+            replacement = self.replacement_cache.resolve(
+                token.group(1), message.guild.id
+            )
 
-    async for i in query:
-        date = i["date"]
-        cmds = i["commands"]
+            if replacement:
+                parts.append(content[last_end : token.start()])
+                parts.append(replacement)
+                last_end = token.end()
 
-        dates.append(date)
-        commands.append(cmds)
+        if parts:
+            # Each replacement is two REST calls, so they're limited per guild like commands are
+            if self.cooldowns.update(
+                "replacements", message.guild.id, *GUILD_REPLACEMENT_COOLDOWN
+            ):
+                return
 
-    plt.clf()
-    plt.plot(dates, commands)
-    plt.title = "Command usage by day"
-    plt.savefig("./data/stats/usage.png")
+            parts.append(content[last_end:])
 
+            # Find the bot's Webhook and send the message on it, unless the bot is too busy
+            try:
+                await send_as_author(ctx, "".join(parts), REPLACEMENT)
+            except Overloaded:
+                return
 
-if __name__ == "__main__":
-    bot = Emojis()
+            # Once the copy is sent the original has to go, so this isn't dropped under load
+            await self.rest.call(
+                "messages:%d" % message.channel.id, BULK, message.delete
+            )
+
+
+def create_bot(**options) -> Emojis:
+    """
+    Make the bot and load every extension.
+
+    :param options: [Optional] Options for Emojis, e.g. shard_ids and shard_count to run some of the shards.
+    """
+    bot = Emojis(**options)
 
     # Remove the default help command so a better one can be added
     bot.remove_command("help")
@@ -336,11 +604,25 @@ if __name__ == "__main__":
     for cog in listdir("./src/exts/"):
         if not cog.startswith("_"):
             file_name, file_extension = splitext(cog)
-            bot.load_extension("src.exts.%s" % file_name)
+
+            with bot.startup_timer.measure("load src.exts.%s" % file_name):
+                bot.load_extension("src.exts.%s" % file_name)
 
     # Reload the Misc extension to update the help command
-    bot.reload_extension("src.exts.misc")
+    with bot.startup_timer.measure("reload src.exts.misc"):
+        bot.reload_extension("src.exts.misc")
 
-    # Code written after this block may not run
+    return bot
+
+
+def read_token() -> str:
     with open("./data/token.txt", "r") as token:
-        bot.run(token.readline())
+        return token.readline()
+
+
+if __name__ == "__main__":
+    # To split the shards between several processes, run cluster.py instead
+    bot = create_bot()
+
+    # Code written after this block may not run
+    bot.run(read_token())
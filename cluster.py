@@ -0,0 +1,318 @@
+"""
+Run the bot as several processes, each with some of the shards, so it isn't limited to one CPU core.
+
+    python cluster.py --clusters 4
+    python cluster.py --clusters 4 --shards 32
+
+The supervisor (this process) splits the shards between clusters, starts them one at a time so their identifies don't
+collide, and restarts any that exit, backing off if one keeps crashing. It also relays queries between clusters, so
+owner commands like >servers and >usage can report on the whole bot.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import signal
+import sys
+from collections import deque
+from multiprocessing.connection import wait
+from time import monotonic
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from urllib.request import Request, urlopen
+
+from src.common.cluster import ClusterClient, format_shards, split_shards
+
+log = logging.getLogger("cluster")
+
+IDENTIFY_DELAY = 5.0  # Seconds discord.py waits between identifying each shard
+LAUNCH_TIMEOUT = 60.0  # Extra seconds to wait for a cluster to be ready before starting the next anyway
+RESTART_DELAY = 5.0  # Seconds before restarting a cluster that exited, doubled for each crash in a row
+MAX_RESTART_DELAY = 300.0
+STABLE_AFTER = 600.0  # Seconds a cluster has to run for its crashes to be forgotten
+QUERY_TIMEOUT = 5.0  # Seconds to wait for every cluster to answer a query
+
+
+def run_cluster(cluster_id: int, shard_ids: List[int], shard_count: int, conn) -> None:
+    """ The entry point of a cluster's process. """
+    # Imported here, so the supervisor doesn't load the bot
+    from bot import create_bot, read_token
+
+    client = ClusterClient(cluster_id, shard_ids, shard_count, conn, QUERY_TIMEOUT)
+    bot = create_bot(shard_ids=shard_ids, shard_count=shard_count, cluster=client)
+    bot.run(read_token())
+
+
+def recommended_shards(token: str) -> int:
+    """ Ask Discord how many shards the bot should run. """
+    from discord.http import Route
+
+    request = Request(
+        Route.BASE + "/gateway/bot",
+        headers={"Authorization": "Bot " + token, "User-Agent": "Emojis"},
+    )
+
+    with urlopen(request, timeout=30) as response:
+        return json.load(response)["shards"]
+
+
+class Cluster:
+    """ The supervisor's view of a cluster. """
+
+    __slots__ = ["id", "shard_ids", "process", "conn", "started_at", "crashes", "ready"]
+
+    def __init__(self, cluster_id: int, shard_ids: List[int]):
+        self.id = cluster_id
+        self.shard_ids = shard_ids
+        self.process = None
+        self.conn = None
+        self.started_at = 0.0
+        self.crashes = 0
+        self.ready = False
+
+
+class Query:
+    """ A query from one cluster, waiting for the others to answer. """
+
+    __slots__ = ["cluster_id", "nonce", "waiting", "results", "deadline"]
+
+    def __init__(self, cluster_id: int, nonce: int, waiting: Set[int], clusters: int):
+        self.cluster_id = cluster_id
+        self.nonce = nonce
+        self.waiting = waiting
+        self.results = dict.fromkeys(range(clusters))
+        self.deadline = monotonic() + QUERY_TIMEOUT
+
+
+class Supervisor:
+    """ Starts, restarts and relays messages between clusters. Runs synchronously in the parent process. """
+
+    def __init__(self, shard_count: int, clusters: int):
+        """
+        :param shard_count: The total number of shards.
+        :param clusters: The number of processes to split them between.
+        """
+        self.shard_count = shard_count
+        self.clusters = [
+            Cluster(cluster_id, shard_ids)
+            for cluster_id, shard_ids in enumerate(split_shards(shard_count, clusters))
+        ]
+        self.context = multiprocessing.get_context("spawn")
+
+        # Clusters waiting to start, and when they can, in order
+        self._launches: Deque[Tuple[int, float]] = deque(
+            (cluster.id, 0.0) for cluster in self.clusters
+        )
+        self._launching: Optional[Tuple[Cluster, float]] = None
+        self._queries: Dict[Tuple[int, int], Query] = {}
+        self._nonces = 0
+        self._stopping = False
+
+    def run(self) -> None:
+        """ Supervise until interrupted, then stop every cluster. """
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+        try:
+            while True:
+                self._launch_next()
+                self._poll()
+                self._expire_queries()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        """ Ask every cluster to shut down, and kill any that don't. """
+        self._stopping = True
+        running = [c.process for c in self.clusters if c.process is not None]
+
+        for process in running:
+            process.terminate()
+
+        for process in running:
+            process.join(30)
+
+            if process.is_alive():
+                process.kill()
+
+    def _launch_next(self) -> None:
+        """ Start the next waiting cluster, once the one before it is ready. """
+        if self._launching is not None:
+            cluster, deadline = self._launching
+
+            if (
+                not cluster.ready
+                and cluster.process is not None
+                and monotonic() < deadline
+            ):
+                return
+
+            self._launching = None
+
+        if not self._launches or self._launches[0][1] > monotonic():
+            return
+
+        cluster = self.clusters[self._launches.popleft()[0]]
+        parent_conn, child_conn = self.context.Pipe()
+
+        cluster.process = self.context.Process(
+            target=run_cluster,
+            args=(cluster.id, cluster.shard_ids, self.shard_count, child_conn),
+            name="cluster-%d" % cluster.id,
+        )
+        cluster.process.start()
+        child_conn.close()
+
+        cluster.conn = parent_conn
+        cluster.started_at = monotonic()
+        cluster.ready = False
+        self._launching = (
+            cluster,
+            monotonic() + IDENTIFY_DELAY * len(cluster.shard_ids) + LAUNCH_TIMEOUT,
+        )
+
+        log.info(
+            "Started cluster %d (%s), pid %d",
+            cluster.id,
+            format_shards(cluster.shard_ids),
+            cluster.process.pid,
+        )
+
+    def _poll(self) -> None:
+        """ Wait briefly for messages and exits, and handle them. """
+        handles = {}
+
+        for cluster in self.clusters:
+            if cluster.process is not None:
+                handles[cluster.process.sentinel] = cluster
+
+            if cluster.conn is not None:
+                handles[cluster.conn] = cluster
+
+        for handle in wait(list(handles), timeout=0.5):
+            cluster = handles[handle]
+
+            if handle is cluster.conn:
+                self._read(cluster)
+            elif cluster.process is not None:
+                self._exited(cluster)
+
+    def _read(self, cluster: Cluster) -> None:
+        try:
+            while cluster.conn.poll():
+                self._handle(cluster, cluster.conn.recv())
+        except (EOFError, OSError):
+            # The process is exiting. Its sentinel will say so
+            cluster.conn.close()
+            cluster.conn = None
+
+    def _handle(self, cluster: Cluster, message: dict) -> None:
+        if message["op"] == "ready":
+            cluster.ready = True
+            log.info("Cluster %d is ready", cluster.id)
+        elif message["op"] == "query":
+            self._nonces += 1
+            query = Query(
+                cluster.id,
+                message["nonce"],
+                {c.id for c in self.clusters if c.conn is not None},
+                len(self.clusters),
+            )
+            self._queries[(cluster.id, self._nonces)] = query
+
+            for target in self.clusters:
+                if target.id in query.waiting:
+                    self._send(
+                        target,
+                        {
+                            "op": "query",
+                            "nonce": (cluster.id, self._nonces),
+                            "name": message["name"],
+                        },
+                    )
+
+            # Every cluster might have gone away in the meantime
+            self._check((cluster.id, self._nonces))
+        elif message["op"] == "reply":
+            query = self._queries.get(message["nonce"])
+
+            if query is not None:
+                query.results[cluster.id] = message["result"]
+                query.waiting.discard(cluster.id)
+                self._check(message["nonce"])
+
+    def _check(self, key: Tuple[int, int]) -> None:
+        """ Answer a query if every cluster has. """
+        query = self._queries.get(key)
+
+        if query is not None and (not query.waiting or query.deadline < monotonic()):
+            del self._queries[key]
+            self._send(
+                self.clusters[query.cluster_id],
+                {"op": "result", "nonce": query.nonce, "results": query.results},
+            )
+
+    def _expire_queries(self) -> None:
+        for key in list(self._queries):
+            self._check(key)
+
+    def _send(self, cluster: Cluster, message: dict) -> None:
+        if cluster.conn is None:
+            return
+
+        try:
+            cluster.conn.send(message)
+        except OSError:
+            pass
+
+    def _exited(self, cluster: Cluster) -> None:
+        """ Clean up after a cluster's process, and schedule a restart. """
+        cluster.process.join()
+        exitcode = cluster.process.exitcode
+        cluster.process = None
+
+        if cluster.conn is not None:
+            cluster.conn.close()
+            cluster.conn = None
+
+        # Don't keep other clusters' queries waiting for an answer that won't come
+        for key, query in list(self._queries.items()):
+            query.waiting.discard(cluster.id)
+            self._check(key)
+
+        if self._stopping:
+            return
+
+        if monotonic() - cluster.started_at > STABLE_AFTER:
+            cluster.crashes = 0
+
+        delay = min(MAX_RESTART_DELAY, RESTART_DELAY * 2 ** cluster.crashes)
+        cluster.crashes += 1
+        self._launches.append((cluster.id, monotonic() + delay))
+
+        log.error(
+            "Cluster %d exited with code %s, restarting in %.0fs",
+            cluster.id,
+            exitcode,
+            delay,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--clusters", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument(
+        "--shards",
+        type=int,
+        help="The total number of shards. Defaults to Discord's recommendation.",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    with open("./data/token.txt", "r") as token:
+        shards = args.shards or recommended_shards(token.readline().strip())
+
+    supervisor = Supervisor(shards, args.clusters)
+    log.info("Running %d shards in %d clusters", shards, len(supervisor.clusters))
+    supervisor.run()
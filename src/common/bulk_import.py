@@ -0,0 +1,415 @@
+import asyncio
+import logging
+from collections import deque
+from io import BytesIO
+from os.path import basename, splitext
+from re import sub
+from time import monotonic
+from typing import Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+from zipfile import BadZipFile, ZipFile
+
+from discord import HTTPException, Forbidden
+
+from src.common.common import db, Colours, CustomEmojis, Embed
+from src.common.rest import BULK
+from src.common.transcode import MAX_SOURCE_SIZE
+
+log = logging.Logger(__name__)
+
+# Emoji pack archives are bigger than single images
+MAX_PACK_SIZE = 32 * 1024 * 1024
+
+# The most an archive's images can add up to once extracted, so a zip bomb is refused before it's inflated
+MAX_PACK_EXTRACTED_SIZE = 128 * 1024 * 1024
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+
+# Discord error code for "Maximum number of emojis reached"
+MAX_EMOJIS_REACHED = 30008
+
+
+def emoji_name(filename: str) -> str:
+    """
+    Make a valid emoji name from a file name or URL.
+
+    :param filename: The file name or URL.
+    :return: The name, 2-32 characters of letters, numbers and underscores.
+    """
+    stem = splitext(basename(urlparse(filename).path or filename))[0]
+    name = sub(r"[^a-zA-Z0-9_]", "", stem.replace("-", "_").replace(" ", "_"))[:32]
+
+    return name if len(name) >= 2 else "emoji"
+
+
+def read_zip_images(data: bytes) -> Dict[str, bytes]:
+    """
+    Read every image from a zip archive. Blocking, so run it in an executor.
+
+    Sizes are checked from the archive's directory before anything is extracted. Images too big to be an emoji are
+    skipped. Extraction stops at the declared size, so a member can't inflate past it.
+
+    :param data: The archive.
+    :return: Each image's path in the archive -> its contents.
+    """
+    images = {}
+    total = 0
+
+    try:
+        with ZipFile(BytesIO(data)) as archive:
+            for info in archive.infolist():
+                if (
+                    info.is_dir()
+                    or not info.filename.lower().endswith(IMAGE_EXTENSIONS)
+                    or info.file_size > MAX_SOURCE_SIZE
+                ):
+                    continue
+
+                total += info.file_size
+
+                if total > MAX_PACK_EXTRACTED_SIZE:
+                    raise Exception("That pack is too big to import.")
+
+                images[info.filename] = archive.read(info)
+    except BadZipFile:
+        raise Exception("That pack couldn't be opened.")
+
+    return images
+
+
+class ImportJob:
+    """
+    A list of emojis to upload to a guild, and how far through it the upload is.
+
+    Jobs are saved to db.imports as they progress, so they can be resumed after a restart.
+    """
+
+    __slots__ = [
+        "id",
+        "guild_id",
+        "channel_id",
+        "message_id",
+        "items",
+        "done",
+        "failed",
+    ]
+
+    def __init__(
+        self,
+        job_id: int,
+        guild_id: int,
+        channel_id: int,
+        message_id: int,
+        items: List[dict],
+        done: int = 0,
+        failed: int = 0,
+    ):
+        """
+        :param job_id: A unique ID for the job. The ID of the command message is used.
+        :param guild_id: The ID of the Guild to upload to.
+        :param channel_id: The ID of the channel with the progress message.
+        :param message_id: The ID of the progress message.
+        :param items: The emojis to upload: {"name", "url"}, plus "member" for images inside a zip at "url".
+        :param done: The number of items already handled.
+        :param failed: The number of items that couldn't be uploaded.
+        """
+        self.id = job_id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.items = items
+        self.done = done
+        self.failed = failed
+
+    def to_document(self) -> dict:
+        return {
+            "_id": self.id,
+            "guild_id": self.guild_id,
+            "channel_id": self.channel_id,
+            "message_id": self.message_id,
+            "items": self.items,
+            "done": self.done,
+            "failed": self.failed,
+        }
+
+    @classmethod
+    def from_document(cls, document: dict) -> "ImportJob":
+        return cls(
+            document["_id"],
+            document["guild_id"],
+            document["channel_id"],
+            document["message_id"],
+            document["items"],
+            document.get("done", 0),
+            document.get("failed", 0),
+        )
+
+
+class UploadQueue:
+    """
+    Upload queued import jobs, one guild at a time per worker.
+
+    Images for a job are downloaded (and shrunk) in parallel, but uploaded to each guild one by one with a gap between
+    them, backing off when Discord rate limits emoji creation. Progress is shown by editing a single message.
+    """
+
+    __slots__ = [
+        "bot",
+        "interval",
+        "progress_interval",
+        "lookahead",
+        "_queues",
+        "_workers",
+    ]
+
+    def __init__(
+        self,
+        bot,
+        interval: float = 2.0,
+        progress_interval: float = 3.0,
+        lookahead: int = 4,
+    ):
+        """
+        :param bot: The bot.
+        :param interval: Seconds between uploads to the same guild.
+        :param progress_interval: The minimum seconds between edits of a progress message.
+        :param lookahead: The number of images to download ahead of the upload in progress, per job.
+        """
+        self.bot = bot
+        self.interval = interval
+        self.progress_interval = progress_interval
+        self.lookahead = lookahead
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    async def submit(self, job: ImportJob) -> None:
+        """
+        Save a job and queue it for upload.
+
+        :param job: The job.
+        """
+        await db.imports.replace_one({"_id": job.id}, job.to_document(), upsert=True)
+        self._enqueue(job)
+
+    async def resume(self) -> None:
+        """ Queue every unfinished job saved before the last restart, for guilds on this process's shards. """
+        async for document in db.imports.find({}):
+            if self.bot.owns_guild(document["guild_id"]):
+                self._enqueue(ImportJob.from_document(document))
+
+    def pending(self, guild_id: int) -> int:
+        """ The number of jobs waiting for a guild, not counting the one in progress. """
+        queue = self._queues.get(guild_id)
+
+        return queue.qsize() if queue else 0
+
+    def _enqueue(self, job: ImportJob) -> None:
+        queue = self._queues.setdefault(job.guild_id, asyncio.Queue())
+        queue.put_nowait(job)
+
+        if job.guild_id not in self._workers:
+            self._workers[job.guild_id] = self.bot.loop.create_task(
+                self._worker(job.guild_id)
+            )
+
+    async def _worker(self, guild_id: int) -> None:
+        """ Run a guild's jobs in order, then stop once its queue is empty. """
+        queue = self._queues[guild_id]
+
+        try:
+            while not queue.empty():
+                job = queue.get_nowait()
+
+                try:
+                    await self._run(job)
+                except Exception as err:
+                    log.error("Import job %d failed: %s", job.id, err)
+        finally:
+            del self._workers[guild_id]
+            del self._queues[guild_id]
+
+    async def _run(self, job: ImportJob) -> None:
+        """ Upload every remaining emoji in a job. """
+        guild = self.bot.get_guild(job.guild_id)
+
+        if guild is None:  # The bot was removed from the guild
+            await db.imports.delete_one({"_id": job.id})
+            return
+
+        message = await self._progress_message(guild, job)
+        remaining = iter(job.items[job.done :])
+        archives: Dict[str, asyncio.Task] = {}
+
+        # Only download a few images ahead, since uploads are much slower and finished downloads wait in memory
+        downloads: Deque[Tuple[dict, asyncio.Task]] = deque()
+
+        def download_next() -> None:
+            item = next(remaining, None)
+
+            if item is not None:
+                downloads.append(
+                    (item, self.bot.loop.create_task(self._download(item, archives)))
+                )
+
+        for _ in range(self.lookahead):
+            download_next()
+
+        last_progress = monotonic()
+        stopped = None
+
+        try:
+            while downloads:
+                item, download = downloads.popleft()
+
+                try:
+                    image = await download
+                    await self._upload(guild, item["name"], image)
+                except HTTPException as err:
+                    if err.code == MAX_EMOJIS_REACHED or isinstance(err, Forbidden):
+                        stopped = err.text
+                        break
+
+                    job.failed += 1
+                except Exception:
+                    job.failed += 1
+
+                download_next()
+                job.done += 1
+                await db.imports.update_one(
+                    {"_id": job.id}, {"$set": {"done": job.done, "failed": job.failed}}
+                )
+
+                if monotonic() - last_progress > self.progress_interval:
+                    last_progress = monotonic()
+                    await self._show_progress(message, job)
+
+                await asyncio.sleep(self.interval)
+        finally:
+            unawaited = [download for _, download in downloads]
+
+            for task in unawaited + list(archives.values()):
+                task.cancel()
+
+                # Collect errors from tasks that were never awaited, so they aren't logged as unhandled
+                if task.done() and not task.cancelled():
+                    task.exception()
+
+        await db.imports.delete_one({"_id": job.id})
+        await self._show_progress(message, job, finished=True, stopped=stopped)
+
+    async def _download(self, item: dict, archives: Dict[str, asyncio.Task]) -> bytes:
+        """ Fetch and shrink the image for an item. Archives are only downloaded once per job. """
+        if "member" not in item:
+            return await self.bot.fetch_emoji_image(item["url"])
+
+        if item["url"] not in archives:
+            archives[item["url"]] = self.bot.loop.create_task(
+                self._download_archive(item["url"])
+            )
+
+        images = await archives[item["url"]]
+
+        return await self.bot.prepare_emoji_image(images[item["member"]])
+
+    async def _download_archive(self, url: str) -> Dict[str, bytes]:
+        data, _ = await self.bot.fetch_cached(url, MAX_PACK_SIZE)
+
+        return await self.bot.loop.run_in_executor(None, read_zip_images, data)
+
+    async def _upload(self, guild, name: str, image: bytes) -> None:
+        """ Upload an emoji, waiting and retrying if emoji creation is rate limited. """
+        for attempt in range(3):
+            try:
+                await self.bot.rest.call(
+                    "emojis:%d" % guild.id,
+                    BULK,
+                    guild.create_custom_emoji,
+                    name=name,
+                    image=image,
+                )
+                return
+            except HTTPException as err:
+                if err.status != 429 or attempt == 2:
+                    raise
+
+                retry_after = float(err.response.headers.get("Retry-After", 60))
+                await asyncio.sleep(retry_after)
+
+    async def _progress_message(self, guild, job: ImportJob):
+        """
+        Find the job's progress message, or post a new one if it's gone.
+
+        :return: The message, or None if there isn't one and the bot can't post one, e.g. it's lost permissions.
+        """
+        channel = guild.get_channel(job.channel_id)
+
+        if channel is None:
+            return None
+
+        try:
+            return await channel.fetch_message(job.message_id)
+        except HTTPException:
+            pass
+
+        try:
+            message = await channel.send(embed=self._progress_embed(job))
+        except HTTPException:
+            return None
+
+        job.message_id = message.id
+
+        try:
+            await db.imports.update_one(
+                {"_id": job.id}, {"$set": {"message_id": message.id}}
+            )
+        except Exception as err:
+            # The job can still run, it'll just post another message if it's resumed
+            log.error("Couldn't save import job %d's message: %s", job.id, err)
+
+        return message
+
+    async def _show_progress(
+        self, message, job: ImportJob, finished: bool = False, stopped: str = None
+    ) -> None:
+        if message is None:
+            return
+
+        try:
+            await message.edit(embed=self._progress_embed(job, finished, stopped))
+        except HTTPException:
+            pass
+
+    @staticmethod
+    def _progress_embed(
+        job: ImportJob, finished: bool = False, stopped: Optional[str] = None
+    ) -> Embed:
+        uploaded = job.done - job.failed
+        total = len(job.items)
+
+        if stopped:
+            return Embed(
+                colour=Colours.error,
+                description="%s Import stopped after %d/%d emojis: %s"
+                % (CustomEmojis.error, uploaded, total, stopped),
+            )
+        elif finished:
+            return Embed(
+                colour=Colours.success,
+                description="%s Imported %d/%d emojis%s."
+                % (
+                    CustomEmojis.success,
+                    uploaded,
+                    total,
+                    " (%d failed)" % job.failed if job.failed else "",
+                ),
+            )
+        else:
+            return Embed(
+                description="%s Importing emojis... %d/%d done%s."
+                % (
+                    CustomEmojis.waiting,
+                    job.done,
+                    total,
+                    " (%d failed)" % job.failed if job.failed else "",
+                ),
+            )
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+from itertools import count
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional
+
+log = logging.Logger(__name__)
+
+
+class ClusterClient:
+    """
+    A cluster's end of the pipe to the supervisor in cluster.py.
+
+    Each cluster runs some of the bot's shards in its own process. Through the supervisor, a cluster can query every
+    cluster, itself included, e.g. for guild counts to answer >servers. Clusters answer queries with the functions in
+    handlers, which are called on the event loop and must return something picklable.
+    """
+
+    __slots__ = [
+        "id",
+        "shard_ids",
+        "shard_count",
+        "timeout",
+        "handlers",
+        "_conn",
+        "_bot",
+        "_nonces",
+        "_pending",
+    ]
+
+    def __init__(
+        self,
+        cluster_id: int,
+        shard_ids: List[int],
+        shard_count: int,
+        conn: Connection,
+        timeout: float = 5.0,
+    ):
+        """
+        :param cluster_id: The cluster's number, from 0.
+        :param shard_ids: The shards this cluster runs.
+        :param shard_count: The number of shards across every cluster.
+        :param conn: The cluster's end of the pipe to the supervisor.
+        :param timeout: Seconds to wait for every cluster to answer a query.
+        """
+        self.id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.timeout = timeout
+        self.handlers: Dict[str, Callable[[], Any]] = {}
+        self._conn = conn
+        self._bot = None
+        self._nonces = count()
+        self._pending: Dict[int, asyncio.Future] = {}
+
+    def attach(self, bot) -> None:
+        """
+        Start answering queries for a bot, and tell the supervisor when it's ready. Call before the bot runs.
+
+        :param bot: The bot.
+        """
+        self._bot = bot
+        self.handlers["stats"] = lambda: {
+            "guilds": len(bot.guilds),
+            "shards": list(self.shard_ids),
+            "latency": bot.latency,
+            "ready": bot.is_ready(),
+        }
+        self.handlers["usage"] = lambda: dict(bot.command_usage)
+
+        bot.loop.add_reader(self._conn.fileno(), self._read)
+        bot.add_listener(self._on_ready, "on_ready")
+
+    async def query(self, name: str) -> Dict[int, Any]:
+        """
+        Ask every cluster for something, e.g. query("stats").
+
+        :param name: The name of the handler to call in each cluster.
+        :return: Cluster ID -> its answer, for every cluster. The answer is None for clusters that are down, didn't
+        answer in time, or don't know the query.
+        """
+        nonce = next(self._nonces)
+        future = self._pending[nonce] = self._bot.loop.create_future()
+
+        try:
+            self._send({"op": "query", "nonce": nonce, "name": name})
+
+            # The supervisor answers after its own timeout, so this one is only a backstop
+            return await asyncio.wait_for(future, self.timeout * 2)
+        finally:
+            del self._pending[nonce]
+
+    async def _on_ready(self) -> None:
+        self._send({"op": "ready"})
+
+    def _send(self, message: dict) -> None:
+        try:
+            self._conn.send(message)
+        except OSError as err:
+            log.error("Couldn't reach the cluster supervisor: %s", err)
+
+    def _read(self) -> None:
+        """ Handle every message waiting on the pipe. Called by the loop when the pipe is readable. """
+        try:
+            while self._conn.poll():
+                message = self._conn.recv()
+
+                if message["op"] == "query":
+                    self._answer(message)
+                elif message["op"] == "result":
+                    future = self._pending.get(message["nonce"])
+
+                    if future is not None and not future.done():
+                        future.set_result(message["results"])
+        except (EOFError, OSError):
+            # Without the supervisor a restarted cluster would run the same shards twice, so stop too
+            log.error("Lost the cluster supervisor, shutting down.")
+            self._bot.loop.remove_reader(self._conn.fileno())
+            self._bot.loop.create_task(self._bot.close())
+
+    def _answer(self, message: dict) -> None:
+        handler = self.handlers.get(message["name"])
+        result = None
+
+        if handler is not None:
+            try:
+                result = handler()
+            except Exception as err:
+                log.error("Couldn't answer cluster query %s: %s", message["name"], err)
+
+        self._send({"op": "reply", "nonce": message["nonce"], "result": result})
+
+
+def split_shards(shard_count: int, clusters: int) -> List[List[int]]:
+    """
+    Split shard IDs into contiguous, nearly equal runs, one per cluster.
+
+    :param shard_count: The total number of shards.
+    :param clusters: The number of clusters.
+    :return: The shard IDs for each cluster.
+    """
+    clusters = max(1, min(clusters, shard_count))
+
+    return [
+        list(range(i * shard_count // clusters, (i + 1) * shard_count // clusters))
+        for i in range(clusters)
+    ]
+
+
+def format_shards(shard_ids: Optional[List[int]]) -> str:
+    """ Describe a run of shards, e.g. "shards 4-7". """
+    if not shard_ids:
+        return "all shards"
+    elif len(shard_ids) == 1:
+        return "shard %d" % shard_ids[0]
+
+    return "shards %d-%d" % (shard_ids[0], shard_ids[-1])
@@ -1,8 +1,7 @@
 from io import BytesIO
 from typing import *
 
-import motor.motor_asyncio
-from discord import Color, Embed, PartialEmoji, Emoji, Webhook
+from discord import Color, Embed, PartialEmoji, Emoji, Webhook, NotFound
 from discord.utils import get as discord_get
 from discord.ext.commands import (
     Context,
@@ -15,16 +14,42 @@ from discord.ext.commands import (
     check,
     guild_only,
 )
-from requests import get
+
+from src.common.rest import COMMAND
 
 # Prevent IDEs removing these imports -- they see them as not used
 DO_NOT_REMOVE = (Cog, command, has_permissions)
 
 DEFAULT_PREFIX = ">"
 
+
+class LazyDatabase:
+    """ The MongoDB database. The Motor client is only imported and created when a collection is first used. """
+
+    __slots__ = ["_database", "listeners"]
+
+    def __init__(self):
+        self._database = None
+
+        # Functions that make pymongo event listeners, called when the client is created, e.g. Metrics.mongo_listener
+        self.listeners = []
+
+    def __getattr__(self, name):
+        if self._database is None:
+            import motor.motor_asyncio
+
+            client = motor.motor_asyncio.AsyncIOMotorClient(
+                "localhost",
+                27017,
+                event_listeners=[make_listener() for make_listener in self.listeners],
+            )
+            self._database = client.emojis_rewrite
+
+        return getattr(self._database, name)
+
+
 # Set up database
-mg = motor.motor_asyncio.AsyncIOMotorClient("localhost", 27017)
-db = mg.emojis_rewrite
+db = LazyDatabase()
 
 
 class CustomEmojis:
@@ -77,9 +102,56 @@ async def check_if_emoji(ctx, query: str) -> Union[PartialEmoji, None]:
         return None
 
 
-async def get_emojis_webhook(ctx: Context) -> Webhook:
-    """ Find the Emojis webhook, or create it if it doesn't exist. """
-    webhooks = await ctx.channel.webhooks()
-    emojis_webhook = discord_get(webhooks, name="Emojis")
+async def get_emojis_webhook(ctx: Context, priority: int = COMMAND) -> Webhook:
+    """
+    Find the Emojis webhook, or create it if it doesn't exist. Results are cached in bot.webhook_cache.
+
+    :param ctx:
+    :param priority: [Optional] The bot.rest priority for any requests, e.g. REPLACEMENT.
+    """
+    emojis_webhook = ctx.bot.webhook_cache.get(ctx.channel.id)
+
+    if emojis_webhook is None:
+        bucket = "webhooks:%d" % ctx.channel.id
+        webhooks = await ctx.bot.rest.call(bucket, priority, ctx.channel.webhooks)
+        emojis_webhook = discord_get(webhooks, name="Emojis")
+        created = emojis_webhook is None
+
+        if created:
+            emojis_webhook = await ctx.bot.rest.call(
+                bucket, priority, ctx.channel.create_webhook, name="Emojis"
+            )
+
+        ctx.bot.webhook_cache.put(ctx.channel.id, emojis_webhook, created)
+
+    return emojis_webhook
 
-    return emojis_webhook or await ctx.channel.create_webhook(name="Emojis")
+
+async def send_as_author(ctx: Context, content: str, priority: int = COMMAND) -> None:
+    """
+    Send a message on the Emojis webhook, disguised as the author of ctx.
+
+    If the cached webhook has been deleted, the cache entry is dropped and the send is retried once.
+
+    :param ctx:
+    :param content: The message to send.
+    :param priority: [Optional] The bot.rest priority, e.g. REPLACEMENT for emoji replacement.
+    """
+    for attempt in range(2):
+        webhook = await get_emojis_webhook(ctx, priority)
+
+        try:
+            await ctx.bot.rest.call(
+                "webhook:%d" % ctx.channel.id,
+                priority,
+                webhook.send,
+                content,
+                username=ctx.author.display_name,
+                avatar_url=ctx.author.avatar_url,
+            )
+            return
+        except NotFound:
+            ctx.bot.webhook_cache.invalidate(ctx.channel.id)
+
+            if attempt:
+                raise
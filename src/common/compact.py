@@ -0,0 +1,93 @@
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator, Set
+
+
+class SortedIntSet:
+    """
+    A set of 64-bit integers (e.g. Discord IDs) stored in a sorted array, at 8 bytes each.
+
+    A Python set of ints costs around 60 bytes per member. Lookups here are a binary search instead of a hash, fronted
+    by a small bit filter (a one-hash bloom filter, at about a byte per member) so most lookups for non-members return
+    without searching. New members go into a small set first and are merged into the array in batches, so adding many
+    members one at a time doesn't shift the array on every add.
+    """
+
+    __slots__ = ["merge_size", "_sorted", "_pending", "_filter", "_mask"]
+
+    def __init__(self, members: Iterable[int] = (), merge_size: int = 1024):
+        """
+        :param members: [Optional] The initial members.
+        :param merge_size: The number of new members to hold before merging them into the array.
+        """
+        self.merge_size = merge_size
+        self._sorted = array("q", sorted(set(members)))
+        self._pending: Set[int] = set()
+        self._build_filter()
+
+    def __contains__(self, value: int) -> bool:
+        # The same as _hash, inlined since this is the hot path
+        bit = (value ^ (value >> 22)) & self._mask
+
+        if not self._filter[bit >> 3] & (1 << (bit & 7)):
+            return False
+
+        if value in self._pending:
+            return True
+
+        i = bisect_left(self._sorted, value)
+
+        return i < len(self._sorted) and self._sorted[i] == value
+
+    def __len__(self) -> int:
+        return len(self._sorted) + len(self._pending)
+
+    def __iter__(self) -> Iterator[int]:
+        self._merge()
+
+        return iter(self._sorted)
+
+    def add(self, value: int) -> None:
+        if value in self:
+            return
+
+        self._pending.add(value)
+        self._set_bit(value)
+
+        if len(self._pending) >= self.merge_size:
+            self._merge()
+
+    def discard(self, value: int) -> None:
+        # The filter bit is left set, which only costs a search on later lookups
+        self._pending.discard(value)
+        i = bisect_left(self._sorted, value)
+
+        if i < len(self._sorted) and self._sorted[i] == value:
+            del self._sorted[i]
+
+    def _hash(self, value: int) -> int:
+        """ The index of a value's bit in the filter. """
+        # Snowflakes have a timestamp above bit 22, so fold it into the low bits to spread IDs made close together
+        return (value ^ (value >> 22)) & self._mask
+
+    def _set_bit(self, value: int) -> None:
+        bit = self._hash(value)
+        self._filter[bit >> 3] |= 1 << (bit & 7)
+
+    def _merge(self) -> None:
+        """ Move the pending members into the array, keeping it sorted. """
+        if self._pending:
+            self._sorted = array(
+                "q", sorted(self._sorted.tolist() + list(self._pending))
+            )
+            self._pending = set()
+            self._build_filter()
+
+    def _build_filter(self) -> None:
+        """ Size the filter to at least 8 bits per member (plus room for a merge's worth of new ones), and fill it. """
+        bits = 1 << max(13, (len(self._sorted) + self.merge_size).bit_length() + 3)
+        self._mask = bits - 1
+        self._filter = bytearray(bits >> 3)
+
+        for value in self._sorted:
+            self._set_bit(value)
@@ -0,0 +1,137 @@
+import asyncio
+from collections import OrderedDict
+from time import monotonic
+from typing import Dict, List
+
+from discord.ext.commands import BucketType, CommandOnCooldown, Cooldown, check
+
+GLOBAL_COOLDOWN = (1.0, 5.0)  # (1.0, 5.0) = 1 command per 5 seconds, per user
+GUILD_COOLDOWN = (10.0, 20.0)  # Commands per guild, so one guild can't hog the budget
+GUILD_REPLACEMENT_COOLDOWN = (30.0, 30.0)  # Emoji replacements per guild
+
+
+class CooldownStore:
+    """
+    Token buckets for rate limiting commands, keyed by a limit name and a user or guild ID.
+
+    Each bucket holds up to rate tokens and refills at rate tokens per per seconds; a command spends one. A full bucket
+    is the same as no bucket, so buckets are only stored while they're refilling, and sweep() drops the rest. Each limit
+    also keeps at most max_size buckets, evicting the least recently used, so memory stays bounded however many users
+    send commands. An evicted bucket just starts full again.
+    """
+
+    __slots__ = [
+        "max_size",
+        "sweep_interval",
+        "swept",
+        "evicted",
+        "_buckets",
+        "_limited",
+    ]
+
+    def __init__(self, max_size: int = 50000, sweep_interval: float = 60.0):
+        """
+        :param max_size: The maximum number of buckets to keep for each limit.
+        :param sweep_interval: Seconds between sweeps for full buckets.
+        """
+        self.max_size = max_size
+        self.sweep_interval = sweep_interval
+        self.swept = 0
+        self.evicted = 0
+
+        # Limit name -> key -> [tokens, last update, rate, per]
+        self._buckets: Dict[str, "OrderedDict[int, List[float]]"] = {}
+        self._limited: Dict[str, int] = {}
+
+    def update(self, name: str, key: int, rate: float, per: float) -> float:
+        """
+        Spend a token from a bucket, if it has one.
+
+        :param name: The name of the limit, e.g. "global" or a command name.
+        :param key: The ID of the User or Guild the bucket is for.
+        :param rate: The number of tokens the bucket holds.
+        :param per: Seconds for an empty bucket to refill.
+        :return: 0 if a token was spent, otherwise the seconds until one is available.
+        """
+        buckets = self._buckets.get(name)
+
+        if buckets is None:
+            buckets = self._buckets[name] = OrderedDict()
+
+        now = monotonic()
+        bucket = buckets.get(key)
+
+        if bucket is None:
+            tokens = rate
+        else:
+            buckets.move_to_end(key)
+            tokens = min(rate, bucket[0] + (now - bucket[1]) * rate / per)
+
+        if tokens < 1:
+            self._limited[name] = self._limited.get(name, 0) + 1
+            return (1 - tokens) * per / rate
+
+        if bucket is None:
+            buckets[key] = [tokens - 1, now, rate, per]
+
+            if len(buckets) > self.max_size:
+                buckets.popitem(last=False)
+                self.evicted += 1
+        else:
+            bucket[0], bucket[1] = tokens - 1, now
+
+        return 0.0
+
+    def sweep(self) -> None:
+        """ Drop every bucket that has refilled. """
+        now = monotonic()
+
+        for buckets in self._buckets.values():
+            full = [
+                key
+                for key, (tokens, updated, rate, per) in buckets.items()
+                if tokens + (now - updated) * rate / per >= rate
+            ]
+
+            for key in full:
+                del buckets[key]
+
+            self.swept += len(full)
+
+    async def run(self) -> None:
+        """ Sweep forever. """
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.sweep()
+
+    def stats(self) -> Dict[str, int]:
+        """ Get the number of buckets and rate limited calls for each limit, and the sweep and eviction counters. """
+        stats = {"swept": self.swept, "evicted": self.evicted}
+
+        for name, buckets in self._buckets.items():
+            stats["%s.buckets" % name] = len(buckets)
+            stats["%s.limited" % name] = self._limited.get(name, 0)
+
+        return stats
+
+
+def cooldown(rate: int, per: float, bucket_type: BucketType = BucketType.default):
+    """
+    A drop-in replacement for discord.ext.commands.cooldown that keeps its buckets in bot.cooldowns.
+
+    :param rate: The number of times the command can be used before it's on cooldown.
+    :param per: Seconds for the cooldown to fully reset.
+    :param bucket_type: Whether the cooldown is per user, per guild, etc.
+    """
+
+    async def predicate(ctx) -> bool:
+        retry_after = ctx.bot.cooldowns.update(
+            ctx.command.qualified_name, bucket_type.get_key(ctx.message), rate, per
+        )
+
+        if retry_after:
+            raise CommandOnCooldown(Cooldown(rate, per, bucket_type), retry_after)
+
+        return True
+
+    return check(predicate)
@@ -0,0 +1,107 @@
+import asyncio
+import json
+from tempfile import TemporaryFile
+from typing import AsyncIterator, IO, List, Tuple
+from zipfile import ZipFile, ZIP_STORED
+
+from discord import Emoji
+
+# Room for the manifest, and the headers zip adds for each file
+MANIFEST_ALLOWANCE = 64 * 1024
+ENTRY_OVERHEAD = 128
+
+
+class ArchivePart:
+    """ One zip file of an export, written to a temporary file on disk rather than kept in memory. """
+
+    __slots__ = ["file", "zip", "size", "manifest"]
+
+    def __init__(self):
+        self.file = TemporaryFile()
+        self.zip = ZipFile(self.file, "w", compression=ZIP_STORED)
+        self.size = 0
+        self.manifest: List[dict] = []
+
+    def add(self, emoji: Emoji, data: bytes) -> None:
+        """ Add an emoji's image. Blocking, so run it in an executor. """
+        extension = "gif" if emoji.animated else "png"
+        filename = "%s-%d.%s" % (emoji.name, emoji.id, extension)
+
+        self.zip.writestr(filename, data)
+        self.size += len(data) + ENTRY_OVERHEAD + len(filename) * 2
+        self.manifest.append(
+            {
+                "name": emoji.name,
+                "id": emoji.id,
+                "animated": emoji.animated,
+                "file": filename,
+            }
+        )
+
+    def finish(self, failed: List[dict]) -> IO[bytes]:
+        """ Write the manifest and close the zip. Blocking, so run it in an executor. """
+        self.zip.writestr(
+            "manifest.json",
+            json.dumps({"emojis": self.manifest, "failed": failed}, indent=2),
+        )
+        self.zip.close()
+        self.file.seek(0)
+
+        return self.file
+
+
+async def stream_emoji_archives(
+    fetcher, emojis: List[Emoji], max_part_size: int, concurrency: int = 8
+) -> AsyncIterator[Tuple[int, IO[bytes]]]:
+    """
+    Download emoji images concurrently and write them into zip files, yielding each one as soon as it's full.
+
+    At most concurrency images are downloaded, or waiting to be written, at once. The caller should close each file
+    after sending it.
+
+    :param fetcher: The bot's Fetcher.
+    :param emojis: The emojis to export.
+    :param max_part_size: The biggest each zip file can be, e.g. the guild's attachment size limit.
+    :param concurrency: The number of downloads to run at once.
+    :return: The part number (from 1) and file of each zip.
+    """
+    loop = asyncio.get_event_loop()
+    pending: asyncio.Queue = asyncio.Queue()
+    results: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+
+    for emoji in emojis:
+        pending.put_nowait(emoji)
+
+    async def download() -> None:
+        while not pending.empty():
+            emoji = pending.get_nowait()
+
+            try:
+                await results.put((emoji, await fetcher.fetch(emoji.url)))
+            except Exception as err:
+                await results.put((emoji, err))
+
+    workers = [loop.create_task(download()) for _ in range(concurrency)]
+    part, part_number, failed = ArchivePart(), 1, []
+
+    try:
+        for _ in range(len(emojis)):
+            emoji, data = await results.get()
+
+            if isinstance(data, Exception):
+                failed.append({"name": emoji.name, "id": emoji.id, "error": str(data)})
+                continue
+
+            # Start a new zip if this image would push the current one over the limit
+            full = part.size + len(data) > max_part_size - MANIFEST_ALLOWANCE
+
+            if full and part.manifest:
+                yield part_number, await loop.run_in_executor(None, part.finish, failed)
+                part, part_number, failed = ArchivePart(), part_number + 1, []
+
+            await loop.run_in_executor(None, part.add, emoji, data)
+
+        yield part_number, await loop.run_in_executor(None, part.finish, failed)
+    finally:
+        for worker in workers:
+            worker.cancel()
@@ -0,0 +1,116 @@
+from itertools import count
+from typing import Dict, Iterable, Optional, Set
+
+from discord import Emoji
+
+
+class EmojiIndex:
+    """
+    An index of every cached emoji, keyed by name.
+
+    Names are stored both exactly and case-folded. Each name maps to the emojis with that name, one per guild, so the
+    emoji from the current guild can be picked first without scanning the cache.
+
+    Every case-folded name also has a version, which changes whenever an emoji with that name is added or removed in
+    any guild, so lookups can be memoized (see ReplacementCache).
+    """
+
+    __slots__ = ["_exact", "_folded", "_guild_names", "_versions", "_changes"]
+
+    def __init__(self):
+        self._exact: Dict[str, Dict[int, Emoji]] = {}
+        self._folded: Dict[str, Dict[int, Emoji]] = {}
+        self._guild_names: Dict[int, Set[str]] = {}
+
+        # Case-folded name -> version, for names with at least one emoji. Versions are never reused, and names without
+        # emojis are version 0, so a memoized miss stays valid until the name is added somewhere
+        self._versions: Dict[str, int] = {}
+        self._changes = count(1)
+
+    def __len__(self) -> int:
+        return sum(len(guilds) for guilds in self._exact.values())
+
+    def rebuild(self, guilds: Iterable) -> None:
+        """
+        Rebuild the index from scratch.
+
+        :param guilds: Every Guild the bot can see.
+        """
+        self._exact.clear()
+        self._folded.clear()
+        self._guild_names.clear()
+        self._versions.clear()
+
+        for guild in guilds:
+            self.update_guild(guild.id, guild.emojis)
+
+    def update_guild(self, guild_id: int, emojis: Iterable[Emoji]) -> None:
+        """
+        Replace a guild's emojis in the index. Called with the full emoji list from on_guild_emojis_update.
+
+        :param guild_id: The ID of the Guild.
+        :param emojis: Every emoji the Guild now has.
+        """
+        self.remove_guild(guild_id)
+
+        names = set()
+
+        for emoji in emojis:
+            # Only the first emoji with a name is reachable, like EmojiConverter
+            self._exact.setdefault(emoji.name, {}).setdefault(guild_id, emoji)
+            self._folded.setdefault(emoji.name.casefold(), {}).setdefault(
+                guild_id, emoji
+            )
+            self._versions[emoji.name.casefold()] = next(self._changes)
+            names.add(emoji.name)
+
+        if names:
+            self._guild_names[guild_id] = names
+
+    def remove_guild(self, guild_id: int) -> None:
+        """
+        Remove a guild's emojis from the index.
+
+        :param guild_id: The ID of the Guild.
+        """
+        for name in self._guild_names.pop(guild_id, ()):
+            for table, key in ((self._exact, name), (self._folded, name.casefold())):
+                guilds = table.get(key)
+
+                if guilds is not None:
+                    guilds.pop(guild_id, None)
+
+                    if not guilds:
+                        del table[key]
+
+            if name.casefold() in self._folded:
+                self._versions[name.casefold()] = next(self._changes)
+            else:
+                self._versions.pop(name.casefold(), None)
+
+    def lookup(self, name: str, guild_id: int = None) -> Optional[Emoji]:
+        """
+        Find an emoji by name.
+
+        Exact matches win over case-insensitive ones, and within each an emoji from guild_id wins over any other.
+
+        :param name: The emoji name, without colons.
+        :param guild_id: [Optional] The ID of the Guild to prefer.
+        :return: The emoji found, or None.
+        """
+        for table, key in ((self._exact, name), (self._folded, name.casefold())):
+            guilds = table.get(key)
+
+            if guilds:
+                return guilds.get(guild_id) or next(iter(guilds.values()))
+
+        return None
+
+    def version(self, name: str) -> int:
+        """
+        Get the version of a name. If it's unchanged, lookup(name, guild_id) returns the same emoji as before.
+
+        :param name: The emoji name, without colons.
+        :return: The version, or 0 if no emoji has the name.
+        """
+        return self._versions.get(name.casefold(), 0)
@@ -0,0 +1,100 @@
+import asyncio
+from typing import Optional
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+
+# Discord rejects emoji images larger than this
+MAX_EMOJI_SIZE = 256 * 1024
+
+
+class Fetcher:
+    """
+    Download images without blocking the event loop.
+
+    One pooled ClientSession is shared by every download, and a semaphore caps how many run at once.
+    """
+
+    __slots__ = [
+        "max_concurrent",
+        "timeout",
+        "chunk_size",
+        "_session",
+        "_semaphore",
+    ]
+
+    def __init__(
+        self,
+        max_concurrent: int = 8,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 10.0,
+        chunk_size: int = 16 * 1024,
+    ):
+        """
+        :param max_concurrent: The maximum number of downloads in flight at once.
+        :param connect_timeout: Seconds to wait for a connection to the host.
+        :param read_timeout: Seconds to wait between chunks of the response.
+        :param chunk_size: The number of bytes to read at a time.
+        """
+        self.max_concurrent = max_concurrent
+        self.timeout = ClientTimeout(
+            total=None, sock_connect=connect_timeout, sock_read=read_timeout
+        )
+        self.chunk_size = chunk_size
+        self._session: Optional[ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def session(self) -> ClientSession:
+        """ The shared ClientSession, created on first use. """
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=TCPConnector(limit=self.max_concurrent),
+                timeout=self.timeout,
+            )
+
+        return self._session
+
+    async def fetch(self, url, max_size: int = MAX_EMOJI_SIZE) -> bytes:
+        """
+        Download a file, giving up as soon as it's bigger than max_size.
+
+        :param url: The URL of the file. Assets are converted to str.
+        :param max_size: The maximum number of bytes to accept.
+        :return: The contents of the file.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        async with self._semaphore:
+            try:
+                async with self.session.get(str(url)) as response:
+                    if response.status != 200:
+                        raise Exception("Couldn't fetch image (%s)." % response.status)
+
+                    # Fail early if the server says the file is too big
+                    if (response.content_length or 0) > max_size:
+                        raise Exception(too_large(max_size))
+
+                    data = bytearray()
+
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        data += chunk
+
+                        if len(data) > max_size:
+                            raise Exception(too_large(max_size))
+            except asyncio.TimeoutError:
+                raise Exception("Couldn't fetch image (timed out).")
+            except ClientError as err:
+                raise Exception("Couldn't fetch image (%s)." % err)
+
+        return bytes(data)
+
+    async def close(self) -> None:
+        """ Close the shared session. """
+        if self._session is not None:
+            await self._session.close()
+
+
+def too_large(max_size: int) -> str:
+    """ The error message for a file bigger than max_size. """
+    return "That image is too big (the limit is %dkb)." % (max_size // 1024)
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from src.common.common import db, DEFAULT_PREFIX
+from src.common.compact import SortedIntSet
+
+log = logging.Logger(__name__)
+
+
+class ConfigCache:
+    """
+    Per-guild prefixes and the user blacklist.
+
+    Prefixes are loaded the first time a guild is seen, rather than all at startup. Every write sets updated_at, and
+    each process polls for documents updated since its last poll, so a change made in one process reaches the others
+    within poll_interval seconds without a restart.
+
+    Almost every guild uses the default prefix, so only custom prefixes are kept in a dict (interned, since many guilds
+    share the same few), and guilds known to use the default are kept in a SortedIntSet. The blacklist is one too.
+    """
+
+    __slots__ = [
+        "poll_interval",
+        "overlap",
+        "load_timeout",
+        "_prefixes",
+        "_defaults",
+        "_blacklist",
+        "_loading",
+        "_since",
+    ]
+
+    def __init__(
+        self,
+        poll_interval: float = 30.0,
+        overlap: float = 60.0,
+        load_timeout: float = 2.0,
+    ):
+        """
+        :param poll_interval: Seconds between polls for changes.
+        :param overlap: Seconds to look back past the last change seen, to allow for clock differences between
+        processes. Changes are applied idempotently, so seeing one twice is harmless.
+        :param load_timeout: Seconds to wait for a guild's prefix before using the default for that message.
+        """
+        self.poll_interval = poll_interval
+        self.overlap = timedelta(seconds=overlap)
+        self.load_timeout = load_timeout
+
+        # Guild ID -> custom prefix, and the IDs of guilds known to use the default
+        self._prefixes: Dict[int, str] = {}
+        self._defaults = SortedIntSet()
+        self._blacklist = SortedIntSet()
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._since = datetime.utcnow()
+
+    async def get_prefix(self, guild_id: Optional[int]) -> str:
+        """
+        Get a guild's prefix, loading it from MongoDB the first time.
+
+        If MongoDB is down or slow, the default prefix is returned without being cached, so the guild is loaded again
+        on its next message.
+
+        :param guild_id: The ID of the Guild, or None for DMs.
+        :return: The prefix.
+        """
+        if guild_id is None:
+            return DEFAULT_PREFIX
+
+        if guild_id in self._prefixes:
+            return self._prefixes[guild_id]
+        elif guild_id in self._defaults:
+            return DEFAULT_PREFIX
+
+        # Share one query between messages that arrive while the guild is loading
+        if guild_id not in self._loading:
+            loading = self._loading[guild_id] = asyncio.ensure_future(
+                db.prefixes.find_one({"id": guild_id}, {"_id": False, "prefix": True})
+            )
+
+            # Collect the error of a query nobody is waiting on any more, so it isn't logged as unhandled
+            loading.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+        try:
+            document = await asyncio.wait_for(
+                asyncio.shield(self._loading[guild_id]), self.load_timeout
+            )
+        except asyncio.TimeoutError:
+            log.error("Timed out loading the prefix for guild %d", guild_id)
+            return DEFAULT_PREFIX
+        except Exception as err:
+            log.error("Couldn't load the prefix for guild %d: %s", guild_id, err)
+            return DEFAULT_PREFIX
+        finally:
+            self._loading.pop(guild_id, None)
+
+        # A poll may have loaded a newer value in the meantime
+        if not self._is_loaded(guild_id):
+            self._store_prefix(guild_id, document["prefix"] if document else None)
+
+        return self._prefixes.get(guild_id, DEFAULT_PREFIX)
+
+    async def set_prefix(self, guild_id: int, prefix: str) -> None:
+        """
+        Change a guild's prefix.
+
+        :param guild_id: The ID of the Guild.
+        :param prefix: The new prefix.
+        """
+        await db.prefixes.update_one(
+            {"id": guild_id},
+            {"$set": {"prefix": prefix, "updated_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        self._store_prefix(guild_id, prefix)
+
+    def is_blacklisted(self, user_id: int) -> bool:
+        return user_id in self._blacklist
+
+    async def blacklist_user(self, user_id: int, reason: str) -> None:
+        """
+        Blacklist a user.
+
+        :param user_id: The ID of the User.
+        :param reason: Why the user was blacklisted.
+        """
+        await db.blacklist.update_one(
+            {"id": user_id},
+            {"$set": {"reason:": reason, "updated_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        self._blacklist.add(user_id)
+
+    async def load_blacklist(self) -> None:
+        """ Load the whole blacklist. It's small, and needed for every command. """
+        async for result in db.blacklist.find({}, {"_id": False, "id": True}):
+            self._blacklist.add(result["id"])
+
+    async def poll(self) -> None:
+        """ Apply changes made by other processes since the last poll. """
+        since = self._since - self.overlap
+        latest = self._since
+
+        async for document in db.prefixes.find(
+            {"updated_at": {"$gt": since}}, {"_id": False}
+        ):
+            latest = max(latest, document["updated_at"])
+
+            # Guilds that haven't been loaded yet will get the new value when they are
+            if self._is_loaded(document["id"]):
+                self._store_prefix(document["id"], document["prefix"])
+
+        async for document in db.blacklist.find(
+            {"updated_at": {"$gt": since}}, {"_id": False}
+        ):
+            latest = max(latest, document["updated_at"])
+            self._blacklist.add(document["id"])
+
+        self._since = latest
+
+    async def run(self) -> None:
+        """ Load the blacklist, then poll for changes forever. """
+        # Keep trying if MongoDB isn't reachable yet, rather than never syncing
+        while True:
+            try:
+                await db.prefixes.create_index("id")
+                await db.prefixes.create_index("updated_at")
+                await db.blacklist.create_index("updated_at")
+                await self.load_blacklist()
+                break
+            except Exception as err:
+                log.error("Couldn't load the blacklist: %s", err)
+                await asyncio.sleep(self.poll_interval)
+
+        while True:
+            await asyncio.sleep(self.poll_interval)
+
+            try:
+                await self.poll()
+            except Exception as err:
+                log.error("Couldn't poll for config changes: %s", err)
+
+    def _is_loaded(self, guild_id: int) -> bool:
+        return guild_id in self._prefixes or guild_id in self._defaults
+
+    def _store_prefix(self, guild_id: int, prefix: Optional[str]) -> None:
+        if prefix is None or prefix == DEFAULT_PREFIX:
+            self._prefixes.pop(guild_id, None)
+            self._defaults.add(guild_id)
+        else:
+            self._defaults.discard(guild_id)
+            self._prefixes[guild_id] = sys.intern(prefix)
@@ -0,0 +1,273 @@
+import asyncio
+import os
+from collections import OrderedDict
+from hashlib import sha256
+from time import monotonic, time
+from typing import Dict, Optional, Tuple
+
+STALE_PART_AGE = 600.0  # Seconds before a part file whose writer might still be running is assumed abandoned
+
+
+class ImageCache:
+    """
+    A content-addressed cache of downloaded images.
+
+    Images are stored by the SHA-256 of their contents, in a memory tier and a disk tier, each evicted
+    least-recently-used once it's over its size limit. URLs map to the hash of what they returned, so the same image
+    reached through different URLs is only stored once. Variants (like a transcoded copy) are stored next to the
+    original under "<hash>.<variant>".
+    """
+
+    __slots__ = [
+        "path",
+        "memory_size",
+        "max_memory_item",
+        "disk_size",
+        "url_ttl",
+        "url_entries",
+        "memory_hits",
+        "disk_hits",
+        "misses",
+        "_memory",
+        "_memory_bytes",
+        "_disk",
+        "_disk_bytes",
+        "_urls",
+    ]
+
+    def __init__(
+        self,
+        path: str = "./tmp/images",
+        memory_size: int = 32 * 1024 * 1024,
+        max_memory_item: int = 8 * 1024 * 1024,
+        disk_size: int = 512 * 1024 * 1024,
+        url_ttl: float = 86400.0,
+        url_entries: int = 100000,
+    ):
+        """
+        :param path: The directory for the disk tier.
+        :param memory_size: The maximum number of bytes to keep in memory.
+        :param max_memory_item: The size of the largest file to keep in memory. Bigger ones, like pack archives, are
+        only kept on disk so one of them can't flush every image out of memory.
+        :param disk_size: The maximum number of bytes to keep on disk.
+        :param url_ttl: Seconds to trust that a URL still returns the same image.
+        :param url_entries: The maximum number of URLs to remember.
+        """
+        self.path = path
+        self.memory_size = memory_size
+        self.max_memory_item = max_memory_item
+        self.disk_size = disk_size
+        self.url_ttl = url_ttl
+        self.url_entries = url_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._urls: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+        self._load_disk()
+
+    def _load_disk(self) -> None:
+        """
+        Pick up files left on disk by a previous run, oldest first.
+
+        Clusters share the directory, so part files are only deleted once their writer has exited or they're too old
+        to still be being written.
+        """
+        os.makedirs(self.path, exist_ok=True)
+
+        entries = sorted(os.scandir(self.path), key=lambda e: e.stat().st_mtime)
+
+        for entry in entries:
+            if entry.name.endswith(".part"):
+                if self._abandoned(entry):
+                    self._delete(entry.name)
+            elif entry.is_file():
+                self._disk[entry.name] = entry.stat().st_size
+                self._disk_bytes += self._disk[entry.name]
+
+    @staticmethod
+    def _abandoned(entry: os.DirEntry) -> bool:
+        """ Whether a part file was left by a writer that's no longer running. """
+        if time() - entry.stat().st_mtime > STALE_PART_AGE:
+            return True
+
+        # Part files are named "<key>.<pid>.part"
+        try:
+            pid = int(entry.name.split(".")[-2])
+        except (IndexError, ValueError):
+            return True
+
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except OSError:  # e.g. the process exists, but belongs to another user
+            pass
+
+        return False
+
+    @staticmethod
+    def key(digest: str, variant: str = None) -> str:
+        """ The cache key for an image, or a variant of it. """
+        return "%s.%s" % (digest, variant) if variant else digest
+
+    def url_digest(self, url: str) -> Optional[str]:
+        """
+        Get the hash of the image a URL returned, if it's known and hasn't expired. Unknown URLs count as misses.
+
+        :param url: The URL.
+        :return: The SHA-256 hex digest, or None.
+        """
+        entry = self._urls.get(url)
+
+        if entry is None or entry[1] < monotonic():
+            self._urls.pop(url, None)
+            self.misses += 1
+            return None
+
+        digest = entry[0]
+
+        self._urls.move_to_end(url)
+        return digest
+
+    async def get(self, digest: str, variant: str = None) -> Optional[bytes]:
+        """
+        Get an image by hash.
+
+        :param digest: The SHA-256 hex digest of the original image.
+        :param variant: [Optional] The variant to get instead of the original.
+        :return: The image, or None if it isn't cached.
+        """
+        key = self.key(digest, variant)
+        data = self._memory.get(key)
+
+        if data is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return data
+
+        if key in self._disk:
+            try:
+                data = await asyncio.get_event_loop().run_in_executor(
+                    None, self._read, key
+                )
+            except OSError:
+                self._forget_disk(key)
+            else:
+                self._disk.move_to_end(key)
+                self._remember(key, data)
+                self.disk_hits += 1
+                return data
+
+        self.misses += 1
+        return None
+
+    async def put(self, data: bytes, digest: str = None, variant: str = None) -> str:
+        """
+        Store an image.
+
+        :param data: The image.
+        :param digest: [Optional] The hash of the original image. Required when storing a variant.
+        :param variant: [Optional] The name of the variant, e.g. "emoji" for a transcoded copy.
+        :return: The hash of the original image.
+        """
+        if digest is None:
+            digest = sha256(data).hexdigest()
+
+        key = self.key(digest, variant)
+        self._remember(key, data)
+
+        if key not in self._disk:
+            try:
+                await asyncio.get_event_loop().run_in_executor(
+                    None, self._write, key, data
+                )
+            except OSError:
+                pass
+            else:
+                self._disk[key] = len(data)
+                self._disk_bytes += len(data)
+
+                while self._disk_bytes > self.disk_size and len(self._disk) > 1:
+                    oldest = next(iter(self._disk))
+                    self._forget_disk(oldest)
+                    asyncio.get_event_loop().run_in_executor(None, self._delete, oldest)
+
+        return digest
+
+    async def put_url(self, url: str, data: bytes) -> str:
+        """
+        Store the image a URL returned.
+
+        :param url: The URL.
+        :param data: The image.
+        :return: The hash of the image.
+        """
+        digest = await self.put(data)
+
+        self._urls[url] = (digest, monotonic() + self.url_ttl)
+        self._urls.move_to_end(url)
+
+        while len(self._urls) > self.url_entries:
+            self._urls.popitem(last=False)
+
+        return digest
+
+    def stats(self) -> Dict[str, float]:
+        """ Get the cache's sizes and hit counters. """
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+
+        return {
+            "memory_bytes": self._memory_bytes,
+            "disk_bytes": self._disk_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+        }
+
+    def _remember(self, key: str, data: bytes) -> None:
+        """ Put an image in the memory tier, evicting the least recently used ones. """
+        if len(data) > min(self.max_memory_item, self.memory_size):
+            return
+
+        if key not in self._memory:
+            self._memory_bytes += len(data)
+
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+
+        while self._memory_bytes > self.memory_size:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _forget_disk(self, key: str) -> None:
+        """ Stop tracking a file in the disk tier. """
+        self._disk_bytes -= self._disk.pop(key, 0)
+
+    def _read(self, key: str) -> bytes:
+        with open(os.path.join(self.path, key), "rb") as f:
+            return f.read()
+
+    def _write(self, key: str, data: bytes) -> None:
+        # Write then rename, so a crash can't leave a half-written file under a valid key
+        # The part file is per process, since clusters share the directory
+        path = os.path.join(self.path, key)
+        part = "%s.%d.part" % (path, os.getpid())
+
+        with open(part, "wb") as f:
+            f.write(data)
+
+        os.replace(part, path)
+
+    def _delete(self, key: str) -> None:
+        try:
+            os.remove(os.path.join(self.path, key))
+        except OSError:
+            pass
@@ -0,0 +1,317 @@
+import asyncio
+import logging
+import os
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import partial
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Tuple
+
+log = logging.Logger(__name__)
+
+# Histogram bucket upper bounds in seconds: 0.1ms to about 100s, each 1.5x the last
+BUCKETS = tuple(0.0001 * 1.5 ** i for i in range(35))
+
+# Metric name, and sorted (label, value) pairs
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class Histogram:
+    """ Counts of observations in fixed, exponentially sized buckets, which is enough to estimate percentiles. """
+
+    __slots__ = ["counts", "count", "sum"]
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, p: float) -> float:
+        """
+        Estimate a percentile, as the upper bound of the bucket it falls in.
+
+        :param p: The percentile, from 0 to 1.
+        :return: The value, or 0 if nothing has been observed.
+        """
+        if not self.count:
+            return 0.0
+
+        target = p * self.count
+        seen = 0
+
+        for i, count in enumerate(self.counts):
+            seen += count
+
+            if seen >= target:
+                return BUCKETS[min(i, len(BUCKETS) - 1)]
+
+        return BUCKETS[-1]
+
+
+class Metrics:
+    """
+    Latency histograms, counters and gauges for the hot paths, exportable in the Prometheus text format.
+
+    Histograms and counters are keyed by a name and labels, e.g. ("command_seconds", {"command": "upload"}). Gauges are
+    read when exported, from the stats() of other components registered with add_source.
+    """
+
+    __slots__ = ["namespace", "labels", "histograms", "counters", "_sources"]
+
+    def __init__(self, namespace: str = "emojis", labels: Dict[str, str] = None):
+        """
+        :param namespace: The prefix for every exported metric name.
+        :param labels: [Optional] Labels for every exported metric, e.g. {"cluster": "0"}.
+        """
+        self.namespace = namespace
+        self.labels = tuple(sorted((labels or {}).items()))
+        self.histograms: Dict[Key, Histogram] = {}
+        self.counters: Dict[Key, float] = {}
+        self._sources: Dict[str, Callable[[], Dict[str, float]]] = {}
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """
+        Record a value, like a latency in seconds, in a histogram.
+
+        :param name: The name of the histogram, e.g. "command_seconds".
+        :param value: The value.
+        :param labels: [Optional] Labels, e.g. command="upload".
+        """
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+
+        histogram.observe(value)
+
+    def increment(self, name: str, amount: float = 1, **labels: str) -> None:
+        """
+        Add to a counter.
+
+        :param name: The name of the counter, e.g. "rest_requests".
+        :param amount: [Optional] How much to add.
+        :param labels: [Optional] Labels, e.g. route="POST /webhooks/{webhook_id}/{webhook_token}".
+        """
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        """
+        Time a block of code into a histogram, in seconds. Errors are timed too.
+
+        :param name: The name of the histogram.
+        :param labels: [Optional] Labels.
+        """
+        start = perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, **labels)
+
+    def add_source(self, name: str, stats: Callable[[], Dict[str, float]]) -> None:
+        """
+        Export another component's stats as gauges, e.g. add_source("webhook_cache", bot.webhook_cache.stats).
+
+        :param name: The prefix for the component's gauges.
+        :param stats: A function returning gauge name -> value.
+        """
+        self._sources[name] = stats
+
+    def summary(self, name: str, label: str) -> List[Tuple[str, int, float, float]]:
+        """
+        Get the count, p50 and p99 of every histogram with a name, busiest first.
+
+        :param name: The name of the histograms, e.g. "command_seconds".
+        :param label: The label to show for each histogram, e.g. "command".
+        :return: (label value, count, p50, p99) for each histogram.
+        """
+        rows = [
+            (
+                dict(labels).get(label, ""),
+                h.count,
+                h.percentile(0.5),
+                h.percentile(0.99),
+            )
+            for (metric, labels), h in self.histograms.items()
+            if metric == name
+        ]
+
+        return sorted(rows, key=lambda row: row[1], reverse=True)
+
+    def to_prometheus(self) -> str:
+        """ Export everything in the Prometheus text format. """
+        lines = []
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            full_name = "%s_%s" % (self.namespace, name)
+            labels = self.labels + labels
+            cumulative = 0
+
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(
+                    "%s_bucket%s %d"
+                    % (full_name, _labels(labels, le="%.6g" % bound), cumulative)
+                )
+
+            lines.append(
+                "%s_bucket%s %d"
+                % (full_name, _labels(labels, le="+Inf"), histogram.count)
+            )
+            lines.append("%s_sum%s %f" % (full_name, _labels(labels), histogram.sum))
+            lines.append(
+                "%s_count%s %d" % (full_name, _labels(labels), histogram.count)
+            )
+
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(
+                "%s_%s_total%s %g"
+                % (self.namespace, name, _labels(self.labels + labels), value)
+            )
+
+        for source, stats in self._sources.items():
+            try:
+                values = stats()
+            except Exception as err:
+                log.error("Couldn't read stats from %s: %s", source, err)
+                continue
+
+            for gauge, value in values.items():
+                gauge_name = "%s_%s_%s" % (
+                    self.namespace,
+                    source,
+                    gauge.replace(".", "_"),
+                )
+                lines.append("%s%s %g" % (gauge_name, _labels(self.labels), value))
+
+        return "\n".join(lines) + "\n"
+
+    def save(self, path: str = "./data/stats/metrics.prom") -> None:
+        """
+        Write the Prometheus export to a file, e.g. for node_exporter's textfile collector.
+
+        :param path: The file to write.
+        """
+        _write_atomic(path, self.to_prometheus())
+
+    async def run(
+        self,
+        lag_interval: float = 0.5,
+        save_interval: float = 60.0,
+        path: str = "./data/stats/metrics.prom",
+    ) -> None:
+        """
+        Measure event loop lag forever, as how late a sleep wakes up, and save the export periodically.
+
+        :param lag_interval: Seconds between lag measurements.
+        :param save_interval: Seconds between saves.
+        :param path: The file to save to.
+        """
+        loop = asyncio.get_event_loop()
+        last_save = perf_counter()
+
+        while True:
+            start = perf_counter()
+            await asyncio.sleep(lag_interval)
+            self.observe(
+                "loop_lag_seconds", max(0.0, perf_counter() - start - lag_interval)
+            )
+
+            if perf_counter() - last_save > save_interval:
+                last_save = perf_counter()
+
+                # Render on the loop, so nothing changes mid-export, then write in a thread
+                try:
+                    await loop.run_in_executor(
+                        None, _write_atomic, path, self.to_prometheus()
+                    )
+                except OSError as err:
+                    log.error("Couldn't save metrics: %s", err)
+
+    def instrument_http(self, http) -> None:
+        """
+        Count and time every REST request the bot makes, by route. Routes are the templates discord.py uses, like
+        "/channels/{channel_id}/messages", so IDs don't create a metric each.
+
+        :param http: The bot's HTTPClient (bot.http).
+        """
+        request = http.request
+
+        async def timed_request(route, **kwargs):
+            name = "%s %s" % (route.method, route.path)
+            start = perf_counter()
+
+            try:
+                return await request(route, **kwargs)
+            finally:
+                self.increment("rest_requests", route=name)
+                self.observe("rest_seconds", perf_counter() - start, route=name)
+
+        http.request = timed_request
+
+    def mongo_listener(self):
+        """
+        Make a pymongo CommandListener that times every MongoDB command. Pass the method, not the result, to
+        LazyDatabase.listeners, so pymongo is only imported with the client, which happens on the event loop.
+
+        pymongo calls listeners from Motor's worker threads, while the loop may be iterating over the histograms for an
+        export, so the listener hands each update to the loop instead of recording it directly.
+        """
+        from pymongo import monitoring
+
+        metrics = self
+        loop = asyncio.get_event_loop()
+
+        class MongoListener(monitoring.CommandListener):
+            def started(self, event) -> None:
+                pass
+
+            def succeeded(self, event) -> None:
+                loop.call_soon_threadsafe(
+                    partial(
+                        metrics.observe,
+                        "mongo_seconds",
+                        event.duration_micros / 1e6,
+                        command=event.command_name,
+                    )
+                )
+
+            def failed(self, event) -> None:
+                loop.call_soon_threadsafe(
+                    partial(
+                        metrics.increment, "mongo_errors", command=event.command_name
+                    )
+                )
+
+        return MongoListener()
+
+
+def _write_atomic(path: str, text: str) -> None:
+    """ Write then rename, so a scrape never sees a half-written file. """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path + ".tmp", "w") as f:
+        f.write(text)
+
+    os.replace(path + ".tmp", path)
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...], **extra: str) -> str:
+    """ Format labels as {name="value",...}, or "" if there are none. """
+    pairs = list(labels) + list(extra.items())
+
+    if not pairs:
+        return ""
+
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in pairs
+    )
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import logging
+import os
+from typing import List, Optional
+
+log = logging.Logger(__name__)
+
+
+class PackCatalogue:
+    """
+    The list of emoji packs from emoji.gg.
+
+    A snapshot on disk is loaded straight away so the list is available on a cold start, then the list is refreshed in
+    the background with conditional requests. version goes up every time the list changes.
+    """
+
+    __slots__ = ["url", "path", "packs", "version", "_etag", "_last_modified"]
+
+    def __init__(self, url: str, path: str = "./data/packs.json"):
+        """
+        :param url: The packs API endpoint.
+        :param path: Where to keep the snapshot.
+        """
+        self.url = url
+        self.path = path
+        self.packs: List[dict] = []
+        self.version = 0
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+
+        self.load_snapshot()
+
+    def load_snapshot(self) -> None:
+        """ Load the last saved list, if there is one. """
+        try:
+            with open(self.path, "r") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        self.packs = snapshot.get("packs", [])
+        self._etag = snapshot.get("etag")
+        self._last_modified = snapshot.get("last_modified")
+        self.version += 1
+
+    def save_snapshot(self) -> None:
+        """ Save the current list, with the validators needed for the next conditional request. """
+        # Write then rename, so a crash can't leave a truncated snapshot. The temporary file is per process, since
+        # clusters share the snapshot
+        part = "%s.%d.tmp" % (self.path, os.getpid())
+
+        with open(part, "w") as f:
+            json.dump(
+                {
+                    "packs": self.packs,
+                    "etag": self._etag,
+                    "last_modified": self._last_modified,
+                },
+                f,
+            )
+
+        os.replace(part, self.path)
+
+    async def refresh(self, session) -> bool:
+        """
+        Fetch the list if it has changed since the last fetch.
+
+        :param session: The aiohttp ClientSession to use.
+        :return: Whether the list changed.
+        """
+        headers = {}
+
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified:
+            headers["If-Modified-Since"] = self._last_modified
+
+        async with session.get(self.url, headers=headers) as response:
+            if response.status == 304:  # Not modified
+                return False
+            elif response.status != 200:
+                raise Exception("Couldn't fetch emoji packs (%s)." % response.status)
+
+            packs = await response.json(content_type=None)
+            self._etag = response.headers.get("ETag")
+            self._last_modified = response.headers.get("Last-Modified")
+
+        changed = packs != self.packs
+
+        if changed:
+            self.packs = packs
+            self.version += 1
+
+        # Save the validators even if the list is the same
+        await asyncio.get_event_loop().run_in_executor(None, self.save_snapshot)
+
+        return changed
+
+    async def run(
+        self,
+        fetcher,
+        interval: int = 3600,
+        min_backoff: int = 30,
+        max_backoff: int = 3600,
+    ) -> None:
+        """
+        Refresh the list forever, backing off exponentially while the endpoint is failing.
+
+        :param fetcher: The bot's Fetcher, for its shared session.
+        :param interval: Seconds between refreshes.
+        :param min_backoff: Seconds to wait after the first failure.
+        :param max_backoff: The longest to wait after repeated failures.
+        """
+        backoff = min_backoff
+
+        while True:
+            try:
+                await self.refresh(fetcher.session)
+            except Exception as err:
+                log.error(
+                    "Couldn't refresh emoji packs, retrying in %ds: %s", backoff, err
+                )
+
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, max_backoff)
+            else:
+                backoff = min_backoff
+
+                await asyncio.sleep(interval)
@@ -0,0 +1,202 @@
+import asyncio
+from random import randrange
+from time import perf_counter
+from typing import Awaitable, Callable, List, Optional
+
+from discord import Embed, HTTPException
+
+from src.common.rest import COMMAND
+
+PREVIOUS, SELECT, NEXT, SHUFFLE = "⬅", "👍", "➡", "🔀"
+
+
+class Paginator:
+    """
+    An Embed that can be paged through with reactions.
+
+    Runs as a single loop fed by one raw_reaction_add listener. Reactions that arrive while a page is being edited are
+    applied together, so rapid clicks cause one edit rather than one each.
+    """
+
+    __slots__ = [
+        "ctx",
+        "page_count",
+        "render",
+        "on_select",
+        "prefetch",
+        "shuffle",
+        "timeout",
+        "timeout_embed",
+        "_message",
+        "_queue",
+    ]
+
+    def __init__(
+        self,
+        ctx,
+        page_count: int,
+        render: Callable[[int], Embed],
+        on_select: Optional[Callable[[int], Awaitable]] = None,
+        prefetch: Optional[Callable[[int], Awaitable]] = None,
+        shuffle: bool = False,
+        timeout: float = 30.0,
+        timeout_embed: Optional[Embed] = None,
+    ):
+        """
+        :param ctx:
+        :param page_count: The number of pages.
+        :param render: Create the Embed for a page.
+        :param on_select: [Optional] Called with the current page when 👍 is added. Adds the 👍 control.
+        :param prefetch: [Optional] Called in the background with the pages either side of the current one.
+        :param shuffle: Whether to add the 🔀 control, which jumps to a random page.
+        :param timeout: Seconds to wait for a reaction before stopping.
+        :param timeout_embed: [Optional] An Embed to replace the page with when the paginator stops.
+        """
+        self.ctx = ctx
+        self.page_count = page_count
+        self.render = render
+        self.on_select = on_select
+        self.prefetch = prefetch
+        self.shuffle = shuffle
+        self.timeout = timeout
+        self.timeout_embed = timeout_embed
+        self._message = None
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    @property
+    def controls(self) -> List[str]:
+        """ The reactions to add, in order. """
+        controls = [PREVIOUS]
+
+        if self.on_select:
+            controls.append(SELECT)
+
+        controls.append(NEXT)
+
+        if self.shuffle:
+            controls.append(SHUFFLE)
+
+        return controls
+
+    @property
+    def _reactions_bucket(self) -> str:
+        """ The bot.rest bucket for reactions on the paginator's message. """
+        return "reactions:%d" % self._message.channel.id
+
+    async def run(self, page: int = 0) -> None:
+        """
+        Send the paginator and handle reactions until it times out.
+
+        :param page: The page to start on.
+        """
+        bot = self.ctx.bot
+        self._message = await self.ctx.send(embed=self.render(page))
+
+        if self.page_count <= 1 and not self.on_select:
+            return
+
+        # Adding reactions is slow, so do it while the first page is already usable
+        adding_controls = bot.loop.create_task(self._add_controls())
+        self._prefetch_around(page)
+
+        bot.add_listener(self._on_reaction, "on_raw_reaction_add")
+
+        try:
+            while True:
+                try:
+                    control = await asyncio.wait_for(
+                        self._queue.get(), timeout=self.timeout
+                    )
+                except asyncio.TimeoutError:
+                    if self.timeout_embed:
+                        await self._message.edit(embed=self.timeout_embed)
+
+                    return
+
+                started = perf_counter()
+                controls = [control]
+
+                # Apply any reactions that piled up while the last page was being edited
+                while not self._queue.empty():
+                    controls.append(self._queue.get_nowait())
+
+                new_page = page
+
+                for control in controls:
+                    if control == PREVIOUS:
+                        new_page = max(new_page - 1, 0)
+                    elif control == NEXT:
+                        new_page = min(new_page + 1, self.page_count - 1)
+                    elif control == SHUFFLE:
+                        new_page = randrange(self.page_count)
+                    elif control == SELECT:
+                        try:
+                            await self.on_select(new_page)
+                        except Exception as err:
+                            await self.ctx.error(err)
+
+                if new_page != page:
+                    page = new_page
+
+                    await self._message.edit(embed=self.render(page))
+                    self._prefetch_around(page)
+
+                # Seconds from the reaction being received to the page being updated
+                bot.metrics.observe(
+                    "paginator_seconds",
+                    perf_counter() - started,
+                    command=self.ctx.command.qualified_name,
+                )
+        finally:
+            bot.remove_listener(self._on_reaction, "on_raw_reaction_add")
+            adding_controls.cancel()
+
+    async def _on_reaction(self, payload) -> None:
+        """ Queue reactions to the paginator from the user who started it. """
+        if (
+            payload.message_id == self._message.id
+            and payload.user_id == self.ctx.author.id
+            and payload.emoji.name in self.controls
+        ):
+            self._queue.put_nowait(payload.emoji.name)
+
+            # Remove the reaction so it can be clicked again, without holding up the page change
+            self.ctx.bot.loop.create_task(
+                self._ignore_http_errors(
+                    self.ctx.bot.rest.call(
+                        self._reactions_bucket,
+                        COMMAND,
+                        self._message.remove_reaction,
+                        payload.emoji,
+                        self.ctx.author,
+                    )
+                )
+            )
+
+    async def _add_controls(self) -> None:
+        """ Add the control reactions in order. """
+        for control in self.controls:
+            await self._ignore_http_errors(
+                self.ctx.bot.rest.call(
+                    self._reactions_bucket, COMMAND, self._message.add_reaction, control
+                )
+            )
+
+    def _prefetch_around(self, page: int) -> None:
+        """ Start prefetching the pages either side of page. """
+        if not self.prefetch:
+            return
+
+        for neighbour in (page - 1, page + 1):
+            if 0 <= neighbour < self.page_count:
+                self.ctx.bot.loop.create_task(
+                    self._ignore_http_errors(self.prefetch(neighbour))
+                )
+
+    @staticmethod
+    async def _ignore_http_errors(coro: Awaitable) -> None:
+        """ Await a request that's fine to lose, like removing a reaction without Manage Messages. """
+        try:
+            await coro
+        except HTTPException:
+            pass
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from typing import Set
+
+from discord import HTTPException
+
+from src.common.common import db
+from src.common.rest import BULK
+
+log = logging.Logger(__name__)
+
+
+class WebhookProvisioner:
+    """
+    Set up the Emojis webhook in every channel of a guild ahead of time, for guilds that opt in.
+
+    Other guilds get a webhook the first time a channel needs one (see get_emojis_webhook), so joining a guild costs no
+    webhook requests. Provisioning reuses existing Emojis webhooks, found with one guild.webhooks() request, and only
+    creates the missing ones, a few at a time at BULK priority. Opted-in guilds are provisioned again after a restart to
+    warm bot.webhook_cache.
+    """
+
+    __slots__ = ["bot", "concurrency", "created", "reused", "_semaphore", "_running"]
+
+    def __init__(self, bot, concurrency: int = 4):
+        """
+        :param bot: The bot.
+        :param concurrency: The number of guilds to provision, and webhooks to create in each, at once.
+        """
+        self.bot = bot
+        self.concurrency = concurrency
+        self.created = 0
+        self.reused = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._running: Set[int] = set()
+
+    async def opt_in(self, guild) -> None:
+        """
+        Provision a guild now, and after every restart.
+
+        :param guild: The Guild.
+        """
+        await db.webhook_provisioning.update_one(
+            {"id": guild.id}, {"$set": {"id": guild.id}}, upsert=True
+        )
+        self.queue(guild)
+
+    async def opt_out(self, guild_id: int) -> None:
+        """
+        Go back to creating webhooks when they're first needed. Webhooks that already exist are left alone.
+
+        :param guild_id: The ID of the Guild.
+        """
+        await db.webhook_provisioning.delete_one({"id": guild_id})
+
+    async def is_opted_in(self, guild_id: int) -> bool:
+        return await db.webhook_provisioning.find_one({"id": guild_id}) is not None
+
+    async def resume(self) -> None:
+        """ Provision every opted-in guild the bot is in. """
+        async for document in db.webhook_provisioning.find({}):
+            guild = self.bot.get_guild(document["id"])
+
+            if guild is not None:
+                self.queue(guild)
+
+    def queue(self, guild) -> None:
+        """ Provision a guild in the background, unless it already is being. """
+        if guild.id not in self._running:
+            self._running.add(guild.id)
+            self.bot.loop.create_task(self._provision(guild))
+
+    async def _provision(self, guild) -> None:
+        try:
+            async with self._semaphore:
+                await self._provision_guild(guild)
+        except HTTPException as err:
+            log.error("Couldn't provision webhooks for guild %d: %s", guild.id, err)
+        finally:
+            self._running.discard(guild.id)
+
+    async def _provision_guild(self, guild) -> None:
+        """ Cache every channel's Emojis webhook, creating the ones that don't exist. """
+        webhooks = await self.bot.rest.call(
+            "webhooks:guild:%d" % guild.id, BULK, guild.webhooks
+        )
+        existing = {
+            webhook.channel_id: webhook
+            for webhook in webhooks
+            if webhook.name == "Emojis" and webhook.token
+        }
+
+        for channel_id, webhook in existing.items():
+            self.bot.webhook_cache.put(channel_id, webhook)
+
+        self.reused += len(existing)
+
+        missing = [
+            channel
+            for channel in guild.text_channels
+            if channel.id not in existing
+            and channel.permissions_for(guild.me).manage_webhooks
+        ]
+        creating = asyncio.Semaphore(self.concurrency)
+
+        async def create(channel) -> None:
+            async with creating:
+                # Creation fails if, e.g., the channel has hit Discord's webhook limit
+                try:
+                    webhook = await self.bot.rest.call(
+                        "webhooks:%d" % channel.id,
+                        BULK,
+                        channel.create_webhook,
+                        name="Emojis",
+                    )
+                except HTTPException:
+                    return
+
+            self.bot.webhook_cache.put(channel.id, webhook, created=True)
+            self.created += 1
+
+        await asyncio.gather(*(create(channel) for channel in missing))
@@ -0,0 +1,95 @@
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from src.common.emoji_index import EmojiIndex
+
+# The EmojiIndex version of a token's name, and what the token resolved to, or None if nothing
+Entry = Tuple[int, Optional[str]]
+
+
+class ReplacementCache:
+    """
+    A memo of what each :emoji: token resolves to, per guild, for replace_unparsed_emojis.
+
+    Misses are remembered too, so tokens that aren't emojis cost one lookup here. Each entry is stored with the
+    EmojiIndex version of its name, and is only used while the version is unchanged, so an emoji added, renamed or
+    deleted in any guild invalidates just the entries for that name. Guilds, and tokens within each guild, are evicted
+    least-recently-used.
+    """
+
+    __slots__ = ["index", "max_guilds", "max_tokens", "hits", "misses", "_guilds"]
+
+    def __init__(
+        self, index: EmojiIndex, max_guilds: int = 5000, max_tokens: int = 128
+    ):
+        """
+        :param index: The bot's EmojiIndex.
+        :param max_guilds: The maximum number of guilds to remember tokens for.
+        :param max_tokens: The maximum number of tokens to remember per guild.
+        """
+        self.index = index
+        self.max_guilds = max_guilds
+        self.max_tokens = max_tokens
+        self.hits = 0
+        self.misses = 0
+
+        # Guild ID -> token -> (name version, replacement or None)
+        self._guilds: "OrderedDict[int, OrderedDict[str, Entry]]" = OrderedDict()
+
+    def resolve(self, name: str, guild_id: int) -> Optional[str]:
+        """
+        Find what an unparsed :emoji: should be replaced with, like EmojiIndex.lookup(name, guild_id).
+
+        :param name: The emoji name, without colons.
+        :param guild_id: The ID of the Guild the message is in.
+        :return: The emoji as it's written in a message, e.g. "<:smile:123>", or None if there isn't one.
+        """
+        tokens = self._guilds.get(guild_id)
+
+        if tokens is None:
+            tokens = self._guilds[guild_id] = OrderedDict()
+
+            while len(self._guilds) > self.max_guilds:
+                self._guilds.popitem(last=False)
+        else:
+            self._guilds.move_to_end(guild_id)
+
+        version = self.index.version(name)
+        entry = tokens.get(name)
+
+        if entry is not None and entry[0] == version:
+            tokens.move_to_end(name)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        emoji = self.index.lookup(name, guild_id)
+        replacement = str(emoji) if emoji else None
+
+        tokens[name] = (version, replacement)
+        tokens.move_to_end(name)
+
+        if len(tokens) > self.max_tokens:
+            tokens.popitem(last=False)
+
+        return replacement
+
+    def invalidate_guild(self, guild_id: int) -> None:
+        """
+        Forget every token for a guild, e.g. when its emojis change or it's removed.
+
+        :param guild_id: The ID of the Guild.
+        """
+        self._guilds.pop(guild_id, None)
+
+    def stats(self) -> Dict[str, float]:
+        """ Get the memo's size and hit/miss counters. """
+        lookups = self.hits + self.misses
+
+        return {
+            "guilds": len(self._guilds),
+            "size": sum(len(tokens) for tokens in self._guilds.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,201 @@
+import asyncio
+from collections import deque
+from heapq import heappop, heappush
+from itertools import count
+from time import monotonic
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+# Priorities, most urgent first
+COMMAND = 0  # Replies to commands, which someone is waiting on
+BULK = 1  # Long-running jobs, like imports, that shouldn't be dropped
+REPLACEMENT = 2  # Emoji replacement, which is dropped under load
+
+PRIORITY_NAMES = ("command", "bulk", "replacement")
+
+
+class Overloaded(Exception):
+    """ Raised instead of making a request that was shed because its queue was backed up. """
+
+
+class RestScheduler:
+    """
+    A priority queue in front of outbound Discord requests, which all share one token's global rate limit.
+
+    Requests are queued per bucket (e.g. one channel's webhook) and run one at a time within a bucket. Across buckets,
+    requests are released at up to rate per second, most urgent first, so emoji replacement can't hold up replies to
+    commands during a burst. REPLACEMENT requests are shed when the queues back up or they've waited too long, since a
+    late replacement is worse than none.
+
+    discord.py still handles the per-route limits and 429s itself; this only decides who goes first.
+    """
+
+    __slots__ = [
+        "rate",
+        "max_queue",
+        "max_wait",
+        "_tokens",
+        "_updated",
+        "_queues",
+        "_busy",
+        "_depth",
+        "_order",
+        "_wake",
+        "_dispatcher",
+        "_waits",
+        "_counts",
+        "_shed",
+    ]
+
+    def __init__(
+        self, rate: float = 40.0, max_queue: int = 500, max_wait: float = 10.0
+    ):
+        """
+        :param rate: Requests to release per second. Discord allows 50 per second per token, so leave some headroom.
+        :param max_queue: The number of queued REPLACEMENT requests at which new ones are shed.
+        :param max_wait: Seconds a REPLACEMENT request can wait before it's shed.
+        """
+        self.rate = rate
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        # A token bucket holding up to a second's worth of requests
+        self._tokens = rate
+        self._updated = monotonic()
+
+        # Bucket -> heap of (priority, order, queued at, future), and the buckets with a request in flight
+        self._queues: Dict[str, List[Tuple[int, int, float, asyncio.Future]]] = {}
+        self._busy: Set[str] = set()
+        self._depth = [0] * len(PRIORITY_NAMES)
+        self._order = count()
+        self._wake = asyncio.Event()
+        self._dispatcher = None
+
+        # Metrics, per priority: recent wait times, requests made, and requests shed
+        self._waits: List[Deque[float]] = [deque(maxlen=1000) for _ in PRIORITY_NAMES]
+        self._counts = [0] * len(PRIORITY_NAMES)
+        self._shed = [0] * len(PRIORITY_NAMES)
+
+    async def call(
+        self,
+        bucket: str,
+        priority: int,
+        func: Callable[..., Awaitable],
+        *args,
+        **kwargs,
+    ) -> Any:
+        """
+        Wait for a turn, then make a request.
+
+        :param bucket: What the request is to, e.g. "webhook:<channel ID>". Requests in a bucket run one at a time.
+        :param priority: COMMAND, BULK or REPLACEMENT.
+        :param func: The request, e.g. webhook.send. It's only called once it's this request's turn.
+        :return: What func returns.
+        :raises Overloaded: If the request was shed.
+        """
+        if priority == REPLACEMENT and self._depth[REPLACEMENT] >= self.max_queue:
+            self._shed[priority] += 1
+            raise Overloaded()
+
+        future = asyncio.get_event_loop().create_future()
+        queued_at = monotonic()
+
+        heappush(
+            self._queues.setdefault(bucket, []),
+            (priority, next(self._order), queued_at, future),
+        )
+        self._depth[priority] += 1
+        self._start()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Still queued: the dispatcher skips cancelled futures. Already released: give the turn back
+            if future.done() and not future.cancelled():
+                self._release(bucket)
+            raise
+
+        self._waits[priority].append(monotonic() - queued_at)
+        self._counts[priority] += 1
+
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            self._release(bucket)
+
+    def stats(self) -> Dict[str, float]:
+        """ Get the queue depth, requests made, requests shed, and p50/p99 wait in seconds, for each priority. """
+        stats = {}
+
+        for priority, name in enumerate(PRIORITY_NAMES):
+            waits = sorted(self._waits[priority])
+
+            stats["%s.depth" % name] = self._depth[priority]
+            stats["%s.requests" % name] = self._counts[priority]
+            stats["%s.shed" % name] = self._shed[priority]
+            stats["%s.wait_p50" % name] = waits[len(waits) // 2] if waits else 0.0
+            stats["%s.wait_p99" % name] = (
+                waits[int(len(waits) * 0.99)] if waits else 0.0
+            )
+
+        return stats
+
+    def _start(self) -> None:
+        """ Wake the dispatcher, starting it if it isn't running. """
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.get_event_loop().create_task(self._dispatch())
+
+        self._wake.set()
+
+    def _release(self, bucket: str) -> None:
+        """ Let the next request in a bucket run. """
+        self._busy.discard(bucket)
+        self._wake.set()
+
+    async def _dispatch(self) -> None:
+        """ Release queued requests, most urgent first, at up to rate per second. """
+        while True:
+            bucket = self._next()
+
+            if bucket is None:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+
+            # Wait for a token, then look again in case something more urgent was queued meanwhile
+            now = monotonic()
+            self._tokens = min(
+                self.rate, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+
+            priority, _, queued_at, future = heappop(self._queues[bucket])
+            self._depth[priority] -= 1
+
+            if not self._queues[bucket]:
+                del self._queues[bucket]
+
+            if future.done():  # Cancelled while queued
+                continue
+
+            if priority == REPLACEMENT and now - queued_at > self.max_wait:
+                self._shed[priority] += 1
+                future.set_exception(Overloaded())
+                continue
+
+            self._tokens -= 1
+            self._busy.add(bucket)
+            future.set_result(None)
+
+    def _next(self) -> Optional[str]:
+        """ Find the bucket whose next request is the most urgent, skipping buckets with a request in flight. """
+        best, best_key = None, None
+
+        for bucket, queue in self._queues.items():
+            if bucket not in self._busy and (best_key is None or queue[0] < best_key):
+                best, best_key = bucket, queue[0]
+
+        return best
@@ -0,0 +1,216 @@
+from bisect import bisect_right
+from random import choice, randrange
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+
+from discord import Emoji
+
+
+def trigrams(name: str) -> Set[str]:
+    """ Every run of three characters in a name. """
+    return {name[i : i + 3] for i in range(len(name) - 2)}
+
+
+class SearchResults(Sequence):
+    """
+    The emojis matching a search, in ranked order.
+
+    Only the matching names are held. Each name's emojis are only ever appended to by the index, never changed, so
+    the lengths taken here are a snapshot: pages stay consistent even if the index changes, and an emoji is only picked
+    out when its page is viewed.
+    """
+
+    __slots__ = ["names", "_groups", "_offsets"]
+
+    def __init__(self, names: List[str], groups: List[List[Emoji]]):
+        """
+        :param names: The matching names, best first.
+        :param groups: The emojis with each name. Only the ones there now are included.
+        """
+        self.names = names
+        self._groups = groups
+        self._offsets = []
+
+        total = 0
+
+        for group in groups:
+            self._offsets.append(total)
+            total += len(group)
+
+        self._offsets.append(total)
+
+    def __len__(self) -> int:
+        return self._offsets[-1]
+
+    def __getitem__(self, i: int) -> Emoji:
+        if i < 0:
+            i += len(self)
+
+        if not 0 <= i < len(self):
+            raise IndexError("search result index out of range")
+
+        group = bisect_right(self._offsets, i) - 1
+
+        return self._groups[group][i - self._offsets[group]]
+
+    def sample(self) -> Emoji:
+        """ A random emoji from the results. """
+        return self[randrange(len(self))]
+
+
+class EmojiSearchIndex:
+    """
+    A trigram index over the (lowercase) names of every cached emoji, updated as emojis are added, deleted and renamed.
+
+    Queries only check the names that share every trigram with the query, rather than every emoji. Results are ranked
+    exact > prefix > substring.
+    """
+
+    __slots__ = ["_names", "_trigrams", "_guilds", "_all", "_positions"]
+
+    def __init__(self):
+        # Name -> its emojis. Lists are appended to, but replaced instead of having emojis removed
+        self._names: Dict[str, List[Emoji]] = {}
+        self._trigrams: Dict[str, Set[str]] = {}
+        self._guilds: Dict[int, Dict[int, str]] = {}
+
+        # Every emoji, for sampling in O(1), and where each one is in the list
+        self._all: List[Emoji] = []
+        self._positions: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._all)
+
+    def rebuild(self, guilds: Iterable) -> None:
+        """
+        Rebuild the index from scratch.
+
+        :param guilds: Every Guild the bot can see.
+        """
+        self._names.clear()
+        self._trigrams.clear()
+        self._guilds.clear()
+        self._all.clear()
+        self._positions.clear()
+
+        for guild in guilds:
+            self.update_guild(guild.id, guild.emojis)
+
+    def update_guild(self, guild_id: int, emojis: Iterable[Emoji]) -> None:
+        """
+        Bring a guild's emojis up to date. Only emojis that were added, deleted or renamed are touched.
+
+        :param guild_id: The ID of the Guild.
+        :param emojis: Every emoji the Guild now has.
+        """
+        old = self._guilds.get(guild_id, {})
+        new = {emoji.id: emoji for emoji in emojis}
+
+        removed = [
+            emoji_id
+            for emoji_id, name in old.items()
+            if emoji_id not in new or new[emoji_id].name.lower() != name
+        ]
+        added = [
+            emoji
+            for emoji_id, emoji in new.items()
+            if emoji_id not in old or old[emoji_id] != emoji.name.lower()
+        ]
+
+        for emoji_id in removed:
+            self._remove(emoji_id, old[emoji_id])
+
+        self._add(added)
+
+        if new:
+            self._guilds[guild_id] = {e.id: e.name.lower() for e in new.values()}
+        else:
+            self._guilds.pop(guild_id, None)
+
+    def remove_guild(self, guild_id: int) -> None:
+        """
+        Remove a guild's emojis from the index.
+
+        :param guild_id: The ID of the Guild.
+        """
+        for emoji_id, name in self._guilds.pop(guild_id, {}).items():
+            self._remove(emoji_id, name)
+
+    def search(self, query: str) -> SearchResults:
+        """
+        Find every emoji whose name contains query.
+
+        :param query: The search term. Case-insensitive.
+        :return: The results, exact matches first, then prefix matches, then other matches.
+        """
+        query = query.lower()
+
+        if len(query) < 3:
+            # Too short for trigrams -- check every distinct name instead of every emoji
+            candidates = self._names.keys()
+        else:
+            # Names containing the query must contain all of its trigrams
+            sets = sorted(
+                (self._trigrams.get(t, set()) for t in trigrams(query)), key=len
+            )
+            candidates = sets[0].intersection(*sets[1:])
+
+        names = sorted(
+            (name for name in candidates if query in name),
+            key=lambda name: (name != query, not name.startswith(query), name),
+        )
+
+        return SearchResults(names, [self._names[name] for name in names])
+
+    def sample(self) -> Optional[Emoji]:
+        """ A random emoji, or None if the index is empty. """
+        return choice(self._all) if self._all else None
+
+    def _add(self, emojis: List[Emoji]) -> None:
+        """ Add emojis to the index. Groups are only appended to, which doesn't change existing results. """
+        by_name: Dict[str, List[Emoji]] = {}
+
+        for emoji in emojis:
+            by_name.setdefault(emoji.name.lower(), []).append(emoji)
+
+            self._positions[emoji.id] = len(self._all)
+            self._all.append(emoji)
+
+        for name, group in by_name.items():
+            if name not in self._names:
+                for trigram in trigrams(name):
+                    self._trigrams.setdefault(trigram, set()).add(name)
+
+                self._names[name] = group
+            else:
+                self._names[name].extend(group)
+
+    def _remove(self, emoji_id: int, name: str) -> None:
+        """ Remove an emoji from the index. """
+        position = self._positions.pop(emoji_id, None)
+
+        if position is None:
+            return
+
+        # Swap the last emoji into the gap so removal is O(1)
+        last = self._all.pop()
+
+        if position < len(self._all):
+            self._all[position] = last
+            self._positions[last.id] = position
+
+        # A new list, since existing results may still be reading the old one
+        group = [e for e in self._names.get(name, ()) if e.id != emoji_id]
+
+        if group:
+            self._names[name] = group
+        else:
+            self._names.pop(name, None)
+
+            for trigram in trigrams(name):
+                names = self._trigrams.get(trigram)
+
+                if names is not None:
+                    names.discard(name)
+
+                    if not names:
+                        del self._trigrams[trigram]
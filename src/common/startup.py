@@ -0,0 +1,60 @@
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter
+from typing import Dict, Iterator
+
+
+class StartupTimer:
+    """ Time each stage of startup, so cold-restart regressions can be tracked. """
+
+    __slots__ = ["started_at", "timings"]
+
+    def __init__(self, started_at: float):
+        """
+        :param started_at: The perf_counter() value when the process started.
+        """
+        self.started_at = started_at
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        """
+        Time a block of code.
+
+        :param stage: The name to record the time under.
+        """
+        start = perf_counter()
+
+        try:
+            yield
+        finally:
+            self.timings[stage] = perf_counter() - start
+
+    def mark(self, stage: str) -> None:
+        """
+        Record the time since the process started.
+
+        :param stage: The name to record the time under.
+        """
+        self.timings[stage] = perf_counter() - self.started_at
+
+    def report(self) -> str:
+        """ A readable breakdown of every stage recorded, in milliseconds. """
+        return "\n".join(
+            "%-32s %9.1fms" % (stage, seconds * 1000)
+            for stage, seconds in self.timings.items()
+        )
+
+    def save(self, path: str = "./data/stats/startup.log") -> None:
+        """
+        Append the timings to a log file as a single line.
+
+        :param path: The file to append to.
+        """
+        line = " ".join(
+            "%s=%.1f" % (stage.replace(" ", "_"), seconds * 1000)
+            for stage, seconds in self.timings.items()
+        )
+
+        with open(path, "a") as f:
+            f.write("%s %s\n" % (datetime.utcnow().isoformat(), line))
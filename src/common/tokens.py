@@ -0,0 +1,20 @@
+import re
+from typing import List, Match
+
+# An unparsed emoji like ":smile:". Rendered emojis ("<:smile:123>", "<a:smile:123>") and things like times ("12:30:45")
+# are skipped because the opening colon follows "<" or a word character.
+EMOJI_TOKEN = re.compile(r"(?<![<\w]):([a-zA-Z0-9_-]+):")
+
+
+def find_emoji_tokens(content: str) -> List[Match]:
+    """
+    Find every unparsed ":emoji:" in a message, in a single pass.
+
+    :param content: The message content.
+    :return: A match for each token. group(1) is the emoji name, and span() is where the token is in content.
+    """
+    # Almost every message has no colons at all, so skip the regex for those
+    if ":" not in content:
+        return []
+
+    return list(EMOJI_TOKEN.finditer(content))
@@ -0,0 +1,169 @@
+from io import BytesIO
+from struct import unpack
+from typing import Tuple
+
+from src.common.fetch import MAX_EMOJI_SIZE
+
+# The largest file to download before shrinking it
+MAX_SOURCE_SIZE = 8 * 1024 * 1024
+
+# Images bigger than this are refused before being decoded, to avoid decompression bombs
+MAX_SOURCE_PIXELS = 4096 * 4096
+
+# Animations with more frames, or more pixels across every frame, are refused before their frames are decoded
+MAX_SOURCE_FRAMES = 1000
+MAX_SOURCE_ANIMATION_PIXELS = 64 * MAX_SOURCE_PIXELS
+
+# The sizes to try, largest first (Discord shows emojis at 128x128 at most), and how many frames to keep (1 in n) for animated images
+SIZES = (128, 96, 64, 48, 32)
+FRAME_STEPS = (1, 2, 3, 4)
+
+UNSUPPORTED = "That isn't a supported image. Try a PNG, JPEG, GIF or WebP."
+
+
+def probe_image(data: bytes) -> Tuple[str, int, int]:
+    """
+    Find the format and dimensions of an image from its header, without decoding it.
+
+    :param data: The image.
+    :return: The format ("png", "gif", "jpeg" or "webp"), width and height.
+    """
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        width, height = unpack(">II", data[16:24])
+        return "png", width, height
+
+    if data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+        width, height = unpack("<HH", data[6:10])
+        return "gif", width, height
+
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP" and len(data) >= 30:
+        chunk = data[12:16]
+
+        if chunk == b"VP8 ":
+            width, height = unpack("<HH", data[26:30])
+            return "webp", width & 0x3FFF, height & 0x3FFF
+        elif chunk == b"VP8L":
+            bits = int.from_bytes(data[21:25], "little")
+            return "webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        elif chunk == b"VP8X":
+            width = int.from_bytes(data[24:27], "little") + 1
+            height = int.from_bytes(data[27:30], "little") + 1
+            return "webp", width, height
+
+    if data[:2] == b"\xff\xd8":
+        return ("jpeg",) + _probe_jpeg(data)
+
+    raise Exception(UNSUPPORTED)
+
+
+def _probe_jpeg(data: bytes) -> Tuple[int, int]:
+    """ Walk a JPEG's markers until the start-of-frame, which holds the dimensions. """
+    i = 2
+
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            break
+
+        marker = data[i + 1]
+
+        # Start-of-frame markers, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = unpack(">HH", data[i + 5 : i + 9])
+            return width, height
+
+        i += 2 + unpack(">H", data[i + 2 : i + 4])[0]
+
+    raise Exception(UNSUPPORTED)
+
+
+def needs_transcoding(data: bytes) -> bool:
+    """
+    Check whether an image has to be shrunk before Discord will accept it as an emoji.
+
+    :param data: The image.
+    :return: True if it's over the size limit, False if it can be uploaded as-is.
+    """
+    image_format, width, height = probe_image(data)
+
+    if width * height > MAX_SOURCE_PIXELS:
+        raise Exception("That image is too big (%dx%d)." % (width, height))
+
+    return len(data) > MAX_EMOJI_SIZE
+
+
+def fit_emoji(data: bytes, max_size: int = MAX_EMOJI_SIZE) -> bytes:
+    """
+    Downscale and re-encode an image until it's under max_size. CPU-heavy, so run it in a process pool.
+
+    Static images become PNGs, quantised if needed. Animated images become GIFs, dropping frames if needed.
+
+    :param data: The image.
+    :param max_size: The maximum number of bytes to return.
+    :return: The new image.
+    """
+    # Pillow is only needed in the worker processes
+    from PIL import Image, ImageSequence
+
+    image = Image.open(BytesIO(data))
+
+    frame_count = getattr(image, "n_frames", 1)
+
+    if frame_count > 1:
+        if (
+            frame_count > MAX_SOURCE_FRAMES
+            or image.width * image.height * frame_count > MAX_SOURCE_ANIMATION_PIXELS
+        ):
+            raise Exception(
+                "That animation is too big (%d frames of %dx%d)."
+                % (frame_count, image.width, image.height)
+            )
+
+        # Only keep each frame at the largest size, so a full-size copy never outlives its frame
+        frames = [_resize(frame, SIZES[0]) for frame in ImageSequence.Iterator(image)]
+        duration = image.info.get("duration", 100)
+
+        for size in SIZES:
+            for step in FRAME_STEPS:
+                kept = [_resize(frame, size) for frame in frames[::step]]
+                output = _save(
+                    kept[0],
+                    "GIF",
+                    save_all=True,
+                    append_images=kept[1:],
+                    duration=duration * step,
+                    loop=image.info.get("loop", 0),
+                    disposal=2,
+                    optimize=True,
+                )
+
+                if len(output) <= max_size:
+                    return output
+    else:
+        image = image.convert("RGBA")
+
+        for size in SIZES:
+            resized = _resize(image, size)
+
+            for candidate in (resized, resized.quantize(256)):
+                output = _save(candidate, "PNG", optimize=True)
+
+                if len(output) <= max_size:
+                    return output
+
+    raise Exception("That image is too big, even after shrinking it.")
+
+
+def _resize(image, size: int):
+    """ Shrink an image to fit in size x size, keeping its aspect ratio. """
+    image = image.convert("RGBA")
+    image.thumbnail((size, size))
+
+    return image
+
+
+def _save(image, image_format: str, **options) -> bytes:
+    """ Encode an image to bytes. """
+    output = BytesIO()
+    image.save(output, format=image_format, **options)
+
+    return output.getvalue()
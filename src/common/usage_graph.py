@@ -0,0 +1,71 @@
+import asyncio
+from io import BytesIO
+from typing import Dict, List, Optional
+
+
+class UsageGraph:
+    """
+    A graph of command usage by day, kept up to date incrementally.
+
+    Only days on or after the last one seen are read from MongoDB, and the PNG is re-rendered in a worker thread only
+    when a day's count has changed.
+    """
+
+    __slots__ = ["png", "_days", "_last_date"]
+
+    def __init__(self):
+        self.png: Optional[bytes] = None
+        self._days: Dict[str, int] = {}
+        self._last_date: Optional[str] = None
+
+    async def refresh(self, collection) -> bool:
+        """
+        Fetch new usage data and re-render the graph if it changed.
+
+        :param collection: The historical_usage collection.
+        :return: Whether the graph was re-rendered.
+        """
+        # Dates are stored as YYYY-MM-DD, so they compare in order as strings.
+        # The last day is re-read because its count is still going up.
+        query = {"date": {"$gte": self._last_date}} if self._last_date else {}
+        changed = False
+
+        async for day in collection.find(query, {"_id": False}):
+            if self._days.get(day["date"]) != day["commands"]:
+                self._days[day["date"]] = day["commands"]
+                changed = True
+
+        if not changed:
+            return False
+
+        dates = sorted(self._days)
+        self._last_date = dates[-1]
+
+        # Rendering takes hundreds of milliseconds, so keep it off the event loop
+        self.png = await asyncio.get_event_loop().run_in_executor(
+            None, render_graph, dates, [self._days[d] for d in dates]
+        )
+
+        return True
+
+
+def render_graph(dates: List[str], commands: List[int]) -> bytes:
+    """
+    Render a graph of command usage by day. Uses Figure directly rather than pyplot so it's safe to run in a thread.
+
+    :param dates: The dates, in order.
+    :param commands: The number of commands used on each date.
+    :return: The graph as a PNG.
+    """
+    # matplotlib is slow to import, and most processes never draw a graph
+    from matplotlib.figure import Figure
+
+    figure = Figure()
+    axes = figure.subplots()
+    axes.plot(dates, commands)
+    axes.set_title("Command usage by day")
+
+    buffer = BytesIO()
+    figure.savefig(buffer, format="png")
+
+    return buffer.getvalue()
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import sys
+import threading
+import traceback
+from collections import Counter
+from time import monotonic, sleep
+from typing import List, Optional, Tuple
+
+log = logging.Logger(__name__)
+
+# Frames of the blocking stack to keep, innermost last
+STACK_DEPTH = 12
+
+# File, line number, function and source line of each frame
+Stack = Tuple[Tuple[str, int, str, str], ...]
+
+
+class LoopWatchdog:
+    """
+    Detect callbacks that block the event loop, and log where they were stuck.
+
+    The loop sets a heartbeat every interval seconds. A separate thread checks it, and if it's more than threshold
+    seconds old, grabs the loop thread's current stack once for that stall and logs it, with a count of how many stalls
+    have been seen at that stack. Unlike asyncio's debug mode this costs almost nothing while the loop is healthy: one
+    call_later per interval, and a thread that mostly sleeps.
+    """
+
+    __slots__ = [
+        "loop",
+        "threshold",
+        "interval",
+        "metrics",
+        "stalls",
+        "_beat",
+        "_loop_thread_id",
+        "_generation",
+        "_running",
+    ]
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        threshold: float = 0.25,
+        interval: float = 0.05,
+        metrics=None,
+    ):
+        """
+        :param loop: The event loop to watch.
+        :param threshold: Seconds the loop can be blocked before the stack is captured.
+        :param interval: Seconds between heartbeats, and between checks.
+        :param metrics: [Optional] The bot's Metrics, to count stalls in.
+        """
+        self.loop = loop
+        self.threshold = threshold
+        self.interval = interval
+        self.metrics = metrics
+        self.stalls: Counter = Counter()
+
+        # None until the loop is running, so startup work before then isn't reported
+        self._beat: Optional[float] = None
+        self._loop_thread_id: Optional[int] = None
+
+        # Bumped on every start and stop, so a heartbeat or thread from an earlier start knows to exit
+        self._generation = 0
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self) -> None:
+        """ Start watching. Call from the loop's thread, or before the loop starts in the thread that will run it. """
+        if self._running:
+            return
+
+        self._running = True
+        self._generation += 1
+        self._loop_thread_id = threading.get_ident()
+        self._beat = None
+        self.loop.call_soon_threadsafe(self._heartbeat, self._generation)
+
+        threading.Thread(
+            target=self._watch,
+            args=(self._generation,),
+            name="loop-watchdog",
+            daemon=True,
+        ).start()
+
+    def stop(self) -> None:
+        """ Stop watching. The stall counts are kept. """
+        self._running = False
+        self._generation += 1
+
+    def report(self, limit: int = 5) -> List[Tuple[int, str]]:
+        """
+        Get the stacks that have blocked the loop most often.
+
+        :param limit: The number of stacks to return.
+        :return: (count, formatted stack) for each, most common first.
+        """
+        return [
+            (count, "".join(traceback.format_list(list(stack))))
+            for stack, count in self.stalls.copy().most_common(limit)
+        ]
+
+    def _heartbeat(self, generation: int) -> None:
+        if generation == self._generation:
+            self._beat = monotonic()
+            self.loop.call_later(self.interval, self._heartbeat, generation)
+
+    def _watch(self, generation: int) -> None:
+        """ Runs in the watchdog thread. """
+        stalled_since = None
+
+        while generation == self._generation:
+            sleep(self.interval)
+            beat = self._beat
+
+            if beat is None or monotonic() - beat < self.threshold:
+                continue
+
+            # Only capture each stall once, however long it lasts
+            if stalled_since == beat:
+                continue
+
+            stalled_since = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+
+            if frame is None:  # The loop's thread has exited
+                return
+
+            stack: Stack = tuple(
+                (f.filename, f.lineno, f.name, f.line)
+                for f in traceback.extract_stack(frame)[-STACK_DEPTH:]
+            )
+            del frame
+
+            self.stalls[stack] += 1
+
+            # Metrics belong to the loop's thread, so count the stall there once the loop is free again
+            if self.metrics is not None:
+                self.loop.call_soon_threadsafe(self.metrics.increment, "loop_stalls")
+
+            log.warning(
+                "Event loop blocked for over %.0fms (seen %d times at this stack):\n%s",
+                self.threshold * 1000,
+                self.stalls[stack],
+                "".join(traceback.format_list(list(stack))),
+            )
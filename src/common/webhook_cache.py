@@ -0,0 +1,126 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Dict, Optional, Tuple
+
+from discord import Webhook
+
+
+class WebhookCache:
+    """
+    An in-memory cache of channel ID -> Emojis webhook.
+
+    Entries are evicted least-recently-used once max_size is reached, and expire after ttl seconds so a webhook that
+    was deleted without an event being received is eventually looked up again. The TTL also limits any warm-up, like
+    WebhookProvisioner.resume after a restart, to the first ttl seconds: after that, each channel's webhook is looked up
+    again when it's next needed.
+    """
+
+    __slots__ = ["max_size", "ttl", "grace", "hits", "misses", "_entries", "_created"]
+
+    def __init__(
+        self,
+        max_size: int = 10000,
+        ttl: Optional[float] = 3600.0,
+        grace: float = 30.0,
+    ):
+        """
+        :param max_size: The maximum number of channels to remember.
+        :param ttl: [Optional] Seconds before an entry expires. None to never expire.
+        :param grace: Seconds after the bot creates a webhook during which webhook updates for its channel are assumed
+        to be that creation.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.grace = grace
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, Tuple[Webhook, float]]" = OrderedDict()
+
+        # Channel ID -> when the grace period for a webhook the bot created there ends
+        self._created: Dict[int, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, channel_id: int) -> Optional[Webhook]:
+        """
+        Get the cached webhook for a channel.
+
+        :param channel_id: The ID of the channel.
+        :return: The Webhook, or None if it isn't cached or has expired.
+        """
+        entry = self._entries.get(channel_id)
+
+        if entry is not None:
+            webhook, expires = entry
+
+            if self.ttl is None or expires > monotonic():
+                self._entries.move_to_end(channel_id)
+                self.hits += 1
+                return webhook
+
+            del self._entries[channel_id]
+
+        self.misses += 1
+        return None
+
+    def peek(self, channel_id: int) -> Optional[Webhook]:
+        """ Get the cached webhook for a channel, without counting a hit or miss or refreshing its position. """
+        entry = self._entries.get(channel_id)
+
+        return entry[0] if entry is not None else None
+
+    def put(self, channel_id: int, webhook: Webhook, created: bool = False) -> None:
+        """
+        Cache the webhook for a channel.
+
+        :param channel_id: The ID of the channel.
+        :param webhook: The channel's Emojis webhook.
+        :param created: Whether the bot just created the webhook. The webhook update that creation causes is ignored.
+        """
+        expires = monotonic() + self.ttl if self.ttl is not None else 0.0
+
+        if created:
+            self._created[channel_id] = monotonic() + self.grace
+
+        self._entries[channel_id] = (webhook, expires)
+        self._entries.move_to_end(channel_id)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, channel_id: int) -> None:
+        """
+        Forget the webhook for a channel, e.g. after on_webhooks_update or a NotFound on send.
+
+        :param channel_id: The ID of the channel.
+        """
+        self._entries.pop(channel_id, None)
+        self._created.pop(channel_id, None)
+
+    def recently_created(self, channel_id: int) -> bool:
+        """ Whether the bot created the channel's webhook within the last grace seconds. """
+        now = monotonic()
+
+        # Drop expired grace periods as they're checked, and any others that have piled up
+        if len(self._created) > self.max_size:
+            self._created = {c: t for c, t in self._created.items() if t > now}
+
+        until = self._created.get(channel_id)
+
+        if until is not None and until <= now:
+            del self._created[channel_id]
+            return False
+
+        return until is not None
+
+    def stats(self) -> Dict[str, float]:
+        """ Get the cache's size and hit/miss counters. """
+        lookups = self.hits + self.misses
+
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
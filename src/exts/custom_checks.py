@@ -1,4 +1,7 @@
+from math import ceil
+
 from src.common.common import *
+from src.common.cooldowns import GLOBAL_COOLDOWN, GUILD_COOLDOWN
 
 
 class CustomChecks(Cog):
@@ -12,28 +15,42 @@ class CustomChecks(Cog):
         Checks that affect the entire bot.
 
         Checks implemented:
-            - cooldown: A global cooldown for every command.
+            - cooldown: A global cooldown for every command, per user and per guild.
 
         """
 
         async def cooldown_check() -> bool:
-            """ Implement a global cooldown for every command, defined in bot.cooldown. """
+            """ Implement a global cooldown for every command, using bot.cooldowns. """
             whitelist = ("help",)
 
             if ctx.command.name in whitelist:
                 return True
 
-            # Get current cooldown
-            bucket = self.bot.cooldown.get_bucket(ctx.message)
-            retry_after = bucket.update_rate_limit()
+            # Check the user's bucket first, so a user on cooldown doesn't spend their guild's tokens
+            retry_after = self.bot.cooldowns.update(
+                "global", ctx.author.id, *GLOBAL_COOLDOWN
+            )
 
             if retry_after:  # On cooldown
                 await ctx.error(
-                    "You're on cooldown. Try again in %d seconds." % int(retry_after)
+                    "You're on cooldown. Try again in %d seconds." % ceil(retry_after)
                 )
                 return False
-            else:  # Not on cooldown
-                return True
+
+            if ctx.guild is not None:
+                retry_after = self.bot.cooldowns.update(
+                    "guild", ctx.guild.id, *GUILD_COOLDOWN
+                )
+
+                if retry_after:
+                    await ctx.error(
+                        "This server is sending too many commands. Try again in %d seconds."
+                        % ceil(retry_after)
+                    )
+                    return False
+
+            # Not on cooldown
+            return True
 
         # Checks not in this tuple will be ignored
         active_checks = (cooldown_check,)
@@ -1,4 +1,3 @@
-from random import choice
 from re import sub
 
 from src.common.common import *
@@ -51,14 +50,11 @@ class Fun(Cog):
                 emojis.append(":black_large_square:")
 
         # Disguise as the user and send on Webhook
-        webhook = await get_emojis_webhook(ctx)
-        await webhook.send(
-            " ".join(emojis),
-            username=ctx.author.display_name,
-            avatar_url=ctx.author.avatar_url,
-        )
+        await send_as_author(ctx, " ".join(emojis))
 
-        await ctx.message.delete()
+        await self.bot.rest.call(
+            "messages:%d" % ctx.channel.id, COMMAND, ctx.message.delete
+        )
 
     @command(
         name="random",
@@ -75,14 +71,16 @@ class Fun(Cog):
         :param search: [Optional] A search query that the emoji's name must contain.
         """
         if search:
-            # Make a list of emojis that match the search
-            search = search.lower()
-            emojis = [e for e in self.bot.emojis if search in e.name.lower()]
+            # Pick from the emojis that match the search
+            results = self.bot.search_index.search(search)
+            emoji = results.sample() if results else None
         else:
-            emojis = self.bot.emojis
+            emoji = self.bot.search_index.sample()
+
+        if not emoji:
+            raise Exception("No results. ")
 
-        # Pick and upload a random emoji
-        emoji = choice(emojis)
+        # Upload the random emoji
         await ctx.upload_emoji(emoji.name, emoji.url)
 
     @command(
@@ -1,9 +1,11 @@
 from re import sub
 
-from discord import User
-from discord.ext.commands import is_owner
+from discord import File, User
+from discord.ext.commands import BucketType, is_owner
 
 from src.common.common import *
+from src.common.cooldowns import cooldown
+from src.common.emoji_export import stream_emoji_archives
 
 
 class Management(Cog):
@@ -37,6 +39,19 @@ class Management(Cog):
         new_name = sub(r" ", "_", new_name)
 
         await emoji.edit(name=new_name)
+
+        # Stop replacing :old_name: now. The emoji is indexed under its new name when Discord sends the update, which
+        # may already have arrived
+        if new_name != old_name:
+            self.bot.update_emojis(
+                ctx.guild.id,
+                [
+                    e
+                    for e in ctx.guild.emojis
+                    if not (e.id == emoji.id and e.name == old_name)
+                ],
+            )
+
         await ctx.success("Emoji updated. `:%s:` -> `:%s:`" % (old_name, new_name))
 
     @command(
@@ -56,8 +71,42 @@ class Management(Cog):
             raise Exception("That emoji isn't from this server.")
 
         await emoji.delete(reason="Delete command called by %s" % ctx.author)
+
+        # Stop replacing it now, rather than when Discord sends the update
+        self.bot.update_emojis(
+            ctx.guild.id, [e for e in ctx.guild.emojis if e.id != emoji.id]
+        )
+
         await ctx.success("Emoji deleted.")
 
+    @command(
+        name="export",
+        description="Download all of this server's emojis.",
+        usage=">export",
+        aliases=("backup",),
+    )
+    @guild_only()
+    @has_permissions(manage_emojis=True)
+    @cooldown(1, 300, BucketType.guild)
+    async def export(self, ctx) -> None:
+        """
+        Download every emoji in the server as a zip file, with a manifest.json of names, IDs and whether each emoji is
+        animated. Servers with lots of emojis get several zip files, each small enough to upload.
+
+        :param ctx:
+        """
+        if not ctx.guild.emojis:
+            raise Exception("This server doesn't have any emojis.")
+
+        async with ctx.typing():
+            async for part, archive in stream_emoji_archives(
+                self.bot.fetcher, ctx.guild.emojis, ctx.guild.filesize_limit
+            ):
+                try:
+                    await ctx.send(file=File(archive, filename="emojis-%d.zip" % part))
+                finally:
+                    archive.close()
+
     @command(
         name="prefix",
         description="Update the bot's prefix.",
@@ -66,13 +115,43 @@ class Management(Cog):
     @guild_only()
     @has_permissions(manage_guild=True)
     async def prefix(self, ctx, *, prefix) -> None:
-        await db.prefixes.update_one(
-            {"id": ctx.guild.id}, {"$set": {"prefix": prefix}}, upsert=True
-        )
-        self.bot.prefixes[ctx.guild.id] = prefix
+        await self.bot.config.set_prefix(ctx.guild.id, prefix)
 
         await ctx.success("My new prefix is `%s`." % prefix)
 
+    @command(
+        name="webhooks",
+        description="Set up webhooks in every channel ahead of time.",
+        usage=">webhooks [on/off]",
+    )
+    @guild_only()
+    @has_permissions(manage_webhooks=True)
+    async def webhooks(self, ctx, setting: str = None) -> None:
+        """
+        By default, the Emojis webhook for a channel is created the first time it's needed. Turning this on creates
+        them in every channel now (reusing any that exist), and warms them up after restarts.
+
+        :param ctx:
+        :param setting: [Optional] "on" or "off". Leave it out to see the current setting.
+        """
+        provisioner = self.bot.webhook_provisioner
+
+        if setting is None:
+            enabled = await provisioner.is_opted_in(ctx.guild.id)
+
+            await ctx.success(
+                "Webhook setup is **%s**. Use `>webhooks on` or `>webhooks off` to change it."
+                % ("on" if enabled else "off")
+            )
+        elif setting.lower() == "on":
+            await provisioner.opt_in(ctx.guild)
+            await ctx.success("Setting up webhooks in every channel.")
+        elif setting.lower() == "off":
+            await provisioner.opt_out(ctx.guild.id)
+            await ctx.success("Webhooks will be set up when they're first needed.")
+        else:
+            raise Exception("That isn't a valid setting. Use `on` or `off`.")
+
     @command(
         name="blacklist",
         description="Blacklist a user.",
@@ -81,10 +160,7 @@ class Management(Cog):
     )
     @is_owner()
     async def blacklist(self, ctx, user: User, *, reason="Unspecified") -> None:
-        await db.blacklist.update_one(
-            {"id": user.id}, {"$set": {"reason:": reason}}, upsert=True
-        )
-        self.bot.blacklist.add(user.id)
+        await self.bot.config.blacklist_user(user.id, reason)
 
         await ctx.success("%s blacklisted." % user)
 
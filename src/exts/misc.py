@@ -1,6 +1,10 @@
+from collections import OrderedDict
+from json import dumps, loads
+
 from discord import File
 from discord.ext.commands import Command, CommandNotFound, is_owner
 
+from src.common.cluster import format_shards
 from src.common.common import *
 
 INVITE_URL = "https://discord.com/oauth2/authorize?client_id=749301838859337799&permissions=1946545248&scope=bot"
@@ -11,23 +15,58 @@ WHATS_NEW = (
 )
 
 
+HELP_CACHE_SIZE = 1024  # Rendered help pages to keep, per page and prefix
+PREFIX_PLACEHOLDER = "{prefix}"
+
+
 def setup(bot):
     bot.add_cog(Misc(bot))
 
 
+def with_placeholder(text: str) -> str:
+    """ Swap the hard-coded > prefix in a usage string or description for PREFIX_PLACEHOLDER. """
+    if text.startswith(">"):
+        text = PREFIX_PLACEHOLDER + text[1:]
+
+    return text.replace("`>", "`" + PREFIX_PLACEHOLDER)
+
+
 class Misc(Cog):
-    __slots__ = ["bot"]
+    __slots__ = ["bot", "help_pages", "help_cache"]
 
     def __init__(self, bot):
         self.bot = bot
-        self.base_help_embed = Embed()
-        self.bot.loop.create_task(self.create_help_embed())
 
-    async def create_help_embed(self) -> None:
+        # Page name ("" for the command list) -> Embed JSON with PREFIX_PLACEHOLDER, and (page, prefix) -> Embed
+        self.help_pages: Dict[str, str] = {}
+        self.help_cache: "OrderedDict[Tuple[str, str], Embed]" = OrderedDict()
+
+        # Wait until the other cogs have loaded
+        self.bot.loop.create_task(self.create_help_pages())
+
+    async def create_help_pages(self) -> None:
+        """ Precompute the help Embed for the list of commands, and for each command and alias. """
+        pages = {"": self.create_help_embed().to_dict()}
+
+        for cmd in self.bot.walk_commands():
+            for name in (cmd.name, *cmd.aliases):
+                qualified_name = ("%s %s" % (cmd.full_parent_name, name)).strip()
+                pages[qualified_name.lower()] = self.create_command_embed(
+                    qualified_name.lower(), cmd
+                ).to_dict()
+
+        self.help_pages = {name: dumps(page) for name, page in pages.items()}
+        self.help_cache.clear()
+
+    def create_help_embed(self) -> Embed:
         """ Create the top-level help Embed (list of commands). """
 
         embed = Embed()
-        embed.add_field(name="What's new?", value="⭐ %s" % WHATS_NEW, inline=False)
+        embed.add_field(
+            name="What's new?",
+            value="⭐ %s" % with_placeholder(WHATS_NEW),
+            inline=False,
+        )
 
         # A list of cogs with an extra "Other" cog for uncategorised commands
         cogs = list(self.bot.cogs) + ["Other"]
@@ -37,7 +76,7 @@ class Misc(Cog):
         # Loop through each command and add it to the dictionary
         for cmd in self.bot.walk_commands():
             if not cmd.hidden:
-                cmd_usage = ">" + cmd.name
+                cmd_usage = PREFIX_PLACEHOLDER + cmd.name
 
                 if cmd.cog is not None:
                     command_list[type(cmd.cog).__name__].append(cmd_usage)
@@ -52,21 +91,52 @@ class Misc(Cog):
                     value="```\n%s\n```" % "\n".join(sorted(commands)),  # Code block
                 )
 
-        self.base_help_embed = embed
+        return embed
+
+    @staticmethod
+    def create_command_embed(title: str, cmd: Command) -> Embed:
+        """ Create the help Embed for a command. """
+        return (
+            Embed(title=title)
+            .add_field(
+                name="Description",
+                value=with_placeholder(cmd.description) if cmd.description else "None",
+            )
+            .add_field(
+                name="Usage",
+                value="`%s`" % with_placeholder(cmd.usage) if cmd.usage else "None",
+            )
+            .add_field(
+                name="Aliases",
+                value="`%s`" % "`, `".join(cmd.aliases) if cmd.aliases else "None",
+            )
+        )
 
-    async def get_command_info(self, command_name) -> Command:
+    def render_help(self, page: str, prefix: str) -> Embed:
         """
-        Get information on a command.
+        Get a help page with a guild's prefix filled in.
 
-        :param command_name: The command name to look up.
-        :return: The Command object of the command found.
+        :param page: The page name: a command name or alias, or "" for the list of commands.
+        :param prefix: The prefix to show in usage strings.
+        :return: The Embed.
         """
-        cmd = self.bot.get_command(command_name)
+        key = (page, prefix)
+        embed = self.help_cache.get(key)
 
-        if not cmd:
-            raise CommandNotFound("That command (`%s`) doesn't exist." % command_name)
+        if embed is not None:
+            self.help_cache.move_to_end(key)
+            return embed
 
-        return cmd
+        # The prefix is escaped as a JSON string, since that's what it's substituted into
+        page_json = self.help_pages[page].replace(
+            PREFIX_PLACEHOLDER, dumps(prefix)[1:-1]
+        )
+        embed = self.help_cache[key] = Embed.from_dict(loads(page_json))
+
+        while len(self.help_cache) > HELP_CACHE_SIZE:
+            self.help_cache.popitem(last=False)
+
+        return embed
 
     @command(
         name="help",
@@ -82,24 +152,14 @@ class Misc(Cog):
         :param ctx:
         :param command_name: [Optional] The command name to look up.
         """
-        # Get specific information on a command
-        if command_name:
-            cmd = await self.get_command_info(command_name)
-
-            embed = (
-                Embed(title=command_name.lower())
-                .add_field(name="Description", value=cmd.description or "None")
-                .add_field(name="Usage", value="`%s`" % cmd.usage or "None")
-                .add_field(
-                    name="Aliases",
-                    value="`%s`" % "`, `".join(cmd.aliases) if cmd.aliases else "None",
-                )
-            )
+        page = command_name.lower() if command_name else ""
 
-            await ctx.send(embed=embed)
-        # Get a list of commands
-        else:
-            await ctx.send(embed=self.base_help_embed)
+        if page not in self.help_pages:
+            raise CommandNotFound("That command (`%s`) doesn't exist." % command_name)
+
+        prefix = await self.bot.config.get_prefix(ctx.guild and ctx.guild.id)
+
+        await ctx.send(embed=self.render_help(page, prefix))
 
     @command(
         name="ping",
@@ -175,18 +235,25 @@ class Misc(Cog):
         """ View usage stats for the bot. """
         query = db.usage.find({}, {"_id": False})
 
+        # Usage is flushed to MongoDB every few minutes, so add what hasn't been yet, from every cluster
+        if self.bot.cluster is not None:
+            pending = await self.bot.cluster.query("usage")
+        else:
+            pending = {0: self.bot.command_usage}
+
         async for i in query:
             results = dict(i)
+
+            for usage in pending.values():
+                for cmd, count in (usage or {}).items():
+                    results[cmd] = results.get(cmd, 0) + count
+
             sort = sorted(results, key=lambda x: results[x], reverse=True)
             usage = ["`>%s`: %d" % (x, results[x]) for x in sort]
 
-            pic = None
-
-            try:
-                with open("./data/stats/usage.png", "rb") as f:
-                    pic = File(f)
-            except OSError:
-                pass
+            # The graph is rendered in the background by bot.usage_graph
+            png = self.bot.usage_graph.png
+            pic = File(BytesIO(png), filename="usage.png") if png else None
 
             await ctx.send(
                 embed=Embed(
@@ -198,6 +265,115 @@ class Misc(Cog):
 
             return
 
+    @command(
+        name="metrics",
+        description="View latency and REST metrics.",
+        usage=">metrics",
+        aliases=("perf",),
+        hidden=True,
+    )
+    @is_owner()
+    async def metrics(self, ctx) -> None:
+        """ View p50/p99 latencies for commands and listeners, event loop lag, and the busiest REST routes. """
+        metrics = self.bot.metrics
+        embed = Embed()
+
+        for title, name, label in (
+            ("Commands", "command_seconds", "command"),
+            ("Listeners", "listener_seconds", "listener"),
+            ("Uploads", "upload_emoji_seconds", "stage"),
+            ("Paginators", "paginator_seconds", "command"),
+            ("MongoDB", "mongo_seconds", "command"),
+        ):
+            rows = [
+                "%-24s %7d %8.1fms %8.1fms"
+                % (value[:24], count, p50 * 1000, p99 * 1000)
+                for value, count, p50, p99 in metrics.summary(name, label)[:10]
+            ]
+
+            if rows:
+                embed.add_field(
+                    name=title,
+                    value="```\n%-24s %7s %10s %10s\n%s\n```"
+                    % ("", "count", "p50", "p99", "\n".join(rows)),
+                    inline=False,
+                )
+
+        lag = metrics.summary("loop_lag_seconds", "")
+        routes = sorted(
+            (
+                (dict(labels)["route"], value)
+                for (name, labels), value in metrics.counters.items()
+                if name == "rest_requests"
+            ),
+            key=lambda route: route[1],
+            reverse=True,
+        )
+
+        if lag:
+            _, _, p50, p99 = lag[0]
+            embed.add_field(
+                name="Event loop lag",
+                value="p50 %.1fms, p99 %.1fms" % (p50 * 1000, p99 * 1000),
+                inline=False,
+            )
+
+        if routes:
+            embed.add_field(
+                name="REST requests",
+                value="```\n%s\n```"
+                % "\n".join("%7d %s" % (count, route) for route, count in routes[:10]),
+                inline=False,
+            )
+
+        # The full export, including every histogram bucket and cache stat
+        export = File(
+            BytesIO(metrics.to_prometheus().encode()), filename="metrics.prom"
+        )
+
+        await ctx.send(embed=embed, file=export)
+
+    @command(
+        name="watchdog",
+        description="Turn the event loop watchdog on or off, or see what's been blocking the loop.",
+        usage=">watchdog [on/off]",
+        hidden=True,
+    )
+    @is_owner()
+    async def watchdog(self, ctx, setting: str = None) -> None:
+        """
+        The watchdog logs the stack of any callback that blocks the event loop for too long. It's cheap enough to leave
+        on in production.
+
+        :param ctx:
+        :param setting: [Optional] "on" or "off". Leave it out to see the stacks that have blocked the loop most.
+        """
+        watchdog = self.bot.watchdog
+
+        if setting is None:
+            embed = Embed(
+                description="The watchdog is **%s**, logging blocks over %dms."
+                % ("on" if watchdog.running else "off", watchdog.threshold * 1000)
+            )
+
+            for count, stack in watchdog.report(limit=3):
+                # Keep the innermost frames, which are the interesting ones, within the field limit
+                embed.add_field(
+                    name="Seen %d times" % count,
+                    value="```\n%s\n```" % stack[-1000:],
+                    inline=False,
+                )
+
+            await ctx.send(embed=embed)
+        elif setting.lower() == "on":
+            watchdog.start()
+            await ctx.success("Watchdog on.")
+        elif setting.lower() == "off":
+            watchdog.stop()
+            await ctx.success("Watchdog off.")
+        else:
+            raise Exception("That isn't a valid setting. Use `on` or `off`.")
+
     @command(
         name="reload",
         description="Reload a cog.",
@@ -207,7 +383,13 @@ class Misc(Cog):
     @is_owner()
     async def reload(self, ctx, cog) -> None:
         """ Reload a cog. """
-        await self.bot.reload_extension("src.exts.%s" % cog.lower())
+        self.bot.reload_extension("src.exts.%s" % cog.lower())
+
+        # Commands may have changed. Reloading misc replaces this cog, and the new one builds its own pages
+        if cog.lower() != "misc":
+            await self.create_help_pages()
+
+        await ctx.success("Reloaded `%s`." % cog.lower())
 
     @command(
         name="servers",
@@ -218,5 +400,31 @@ class Misc(Cog):
     )
     @is_owner()
     async def servers(self, ctx):
-        """ View the number of servers the bot is in. """
-        await ctx.send(embed=Embed(description="%d servers" % len(self.bot.guilds)))
+        """ View the number of servers the bot is in, and how they're split between clusters. """
+        if self.bot.cluster is None:
+            await ctx.send(embed=Embed(description="%d servers" % len(self.bot.guilds)))
+            return
+
+        results = await self.bot.cluster.query("stats")
+        lines = []
+
+        for cluster_id, stats in sorted(results.items()):
+            if stats is None:
+                lines.append("`Cluster %d`: no answer" % cluster_id)
+            else:
+                lines.append(
+                    "`Cluster %d` (%s): %d servers, %.0fms%s"
+                    % (
+                        cluster_id,
+                        format_shards(stats["shards"]),
+                        stats["guilds"],
+                        stats["latency"] * 1000,
+                        "" if stats["ready"] else ", starting",
+                    )
+                )
+
+        total = sum(stats["guilds"] for stats in results.values() if stats)
+
+        await ctx.send(
+            embed=Embed(description="%d servers\n\n%s" % (total, "\n".join(lines)))
+        )
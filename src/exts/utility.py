@@ -1,12 +1,22 @@
 import logging
-from asyncio import TimeoutError as TimeoutError_
-from random import randint
 from re import sub
 
-from discord import Member, User, Message, NotFound
-from discord.ext.commands import cooldown, BucketType, is_owner
+from discord import Member, User, NotFound
+from discord.ext.commands import BucketType, is_owner
 
+from src.common.bulk_import import (
+    ImportJob,
+    MAX_PACK_SIZE,
+    emoji_name,
+    read_zip_images,
+)
 from src.common.common import *
+from src.common.cooldowns import cooldown
+from src.common.packs import PackCatalogue
+from src.common.paginator import Paginator
+
+PACKS_URL = "https://discordemoji.com/api/packs"
+PACKS_PER_PAGE = 15
 
 
 class Utility(Cog):
@@ -14,24 +24,49 @@ class Utility(Cog):
 
     def __init__(self, bot):
         self.bot = bot
-        self.packs = get("https://discordemoji.com/api/packs").json()
-        self.packs_embed = self.list_packs()
+        self.catalogue = PackCatalogue(PACKS_URL)
+        self.packs_embeds = []
+        self.packs_embed_version = None
+        self.packs_updater = self.bot.loop.create_task(
+            self.catalogue.run(self.bot.fetcher)
+        )
 
-    def list_packs(self) -> Embed:
-        """ A list of emoji packs from emoji.gg that can be downloaded. """
+    def cog_unload(self):
+        self.packs_updater.cancel()
 
-        list_embed = Embed(
-            title=f"{len(self.packs)} emoji packs available",
-            description="Type `>pack [number]` to view (example: `>pack 1`)\n",
-        )
+    def list_packs(self) -> List[Embed]:
+        """ Pages listing the emoji packs from emoji.gg that can be downloaded. Only rebuilt when the list changes. """
 
-        for count, value in enumerate(self.packs, start=1):
-            list_embed.description += '\n`>pack %d` -- view **"%s"**' % (
-                count,
-                value["name"],
+        if self.packs_embed_version == self.catalogue.version:
+            return self.packs_embeds
+
+        packs = list(enumerate(self.catalogue.packs, start=1))
+        page_count = (len(packs) + PACKS_PER_PAGE - 1) // PACKS_PER_PAGE
+        pages = []
+
+        for start in range(0, len(packs), PACKS_PER_PAGE):
+            page_embed = Embed(
+                title=f"{len(packs)} emoji packs available",
+                description="Type `>pack [number]` to view (example: `>pack 1`)\n",
             )
 
-        return list_embed
+            for count, value in packs[start : start + PACKS_PER_PAGE]:
+                page_embed.description += '\n`>pack %d` -- view **"%s"**' % (
+                    count,
+                    value["name"],
+                )
+
+            if page_count > 1:
+                page_embed.set_footer(
+                    text="Page %d / %d" % (len(pages) + 1, page_count)
+                )
+
+            pages.append(page_embed)
+
+        self.packs_embeds = pages
+        self.packs_embed_version = self.catalogue.version
+
+        return pages
 
     @command(
         name="upload",
@@ -88,6 +123,75 @@ class Utility(Cog):
                         "That doesn't look quite right. Check `>help upload`."
                     )
 
+    @command(
+        name="import",
+        description="Upload lots of emojis at once.",
+        usage=">import [pack number, or URLs]",
+        aliases=("bulk",),
+    )
+    @guild_only()
+    @has_permissions(manage_emojis=True)
+    @cooldown(1, 60, BucketType.guild)
+    async def import_(self, ctx, *sources: str) -> None:
+        """
+        Upload lots of emojis at once. The emojis can come from:
+
+            - An emoji pack, by its number in >packs.
+            - A list of image URLs, separated by spaces.
+            - Attached images.
+
+        Images are downloaded in parallel and uploaded in the background. Progress is shown in a single message, and
+        the import carries on after a restart.
+
+        :param ctx:
+        :param sources: [Optional] A pack number, or image URLs.
+        """
+        items = [
+            {"name": emoji_name(attachment.filename), "url": attachment.url}
+            for attachment in ctx.message.attachments
+        ]
+
+        if len(sources) == 1 and sources[0].isdigit():
+            packs = self.catalogue.packs
+
+            # Pack numbers start at 1, so 0 mustn't wrap around to the last pack
+            if not 1 <= int(sources[0]) <= len(packs):
+                raise Exception(
+                    "That's not a valid pack. Use `>packs` to see a list of available packs."
+                )
+
+            pack = packs[int(sources[0]) - 1]
+
+            # Download the pack now, to list what's in it
+            archive, _ = await self.bot.fetch_cached(pack["download"], MAX_PACK_SIZE)
+            images = await self.bot.loop.run_in_executor(None, read_zip_images, archive)
+
+            items += [
+                {"name": emoji_name(member), "url": pack["download"], "member": member}
+                for member in sorted(images)
+            ]
+        else:
+            items += [
+                {"name": emoji_name(url), "url": url.strip("<>")} for url in sources
+            ]
+
+        if not items:
+            raise Exception("There's nothing to import. Check `>help import`.")
+
+        # There's a limit for both static and animated emojis
+        items = items[: ctx.guild.emoji_limit * 2]
+
+        message = await ctx.send(
+            embed=Embed(
+                description="%s Queued %d emojis for import."
+                % (CustomEmojis.waiting, len(items))
+            )
+        )
+
+        await self.bot.upload_queue.submit(
+            ImportJob(ctx.message.id, ctx.guild.id, ctx.channel.id, message.id, items)
+        )
+
     @command(
         name="pfp",
         description="Turn a profile pic into an emoji.",
@@ -132,89 +236,51 @@ class Utility(Cog):
         :param query: The search term that emoji names must contain.
         """
 
-        def reaction_check(reaction) -> bool:
-            """ Check if the reaction added is valid. """
-            return reaction.member.id == ctx.author.id
+        def render(page: int) -> Embed:
+            """ Create the Embed for a page of results. """
+            emoji = search_results[page]
 
-        async def browse(emojis: list, page: int, existing_msg: Message = None) -> None:
-            """
-            Create and manage an emoji browser.
-
-            :param emojis: The list of emojis to choose from.
-            :param page: The current page number of the browser.
-            :param existing_msg: [Optional] The Message of the current browser. If present, edits the existing message
-            instead of posting a new one.
-            """
-
-            # Pick the Emoji and create the search Embed
-            emoji = emojis[page]
-            embed = (
+            return (
                 Embed(
-                    title="Page %s / %s" % (page + 1, len(emojis)),
+                    title="Page %s / %s" % (page + 1, len(search_results)),
                     description="`:%s:`" % emoji.name,
                 )
                 .set_thumbnail(url=emoji.url)
                 .set_author(icon_url=ctx.author.avatar_url, name=ctx.author.name)
             )
 
-            # If no message exists, send the Embed to the chat
-            if not existing_msg:
-                sent_msg = await ctx.send(embed=embed)
+        async def upload(page: int) -> None:
+            """ Upload the emoji on a page. """
+            emoji = search_results[page]
+            await ctx.upload_emoji(emoji.name, emoji.url)
 
-                for reaction in ("⬅", "👍", "➡", "🔀"):
-                    await sent_msg.add_reaction(reaction)
+        async def prefetch(page: int) -> None:
+            """ Download the emoji on a page ahead of time, so uploading it is quicker. """
+            await self.bot.prefetch_emoji_image(search_results[page].url)
 
-            # If a message does exist, edit it with the new Embed
-            else:
-                sent_msg = existing_msg
-                await sent_msg.edit(embed=embed)
-
-            try:
-                # Wait for a reaction to be added
-                # Times out after 30 seconds and must be a valid emoji (⬅/👍/➡/🔀)
-                reaction = await self.bot.wait_for(
-                    "raw_reaction_add", timeout=30.0, check=reaction_check
-                )
-            except TimeoutError_:  # asyncio.TimeoutError
-                await sent_msg.edit(
-                    embed=Embed(
-                        colour=Colours.error,
-                        description="%s This search timed out." % CustomEmojis.error,
-                    )
-                )
-            else:
-                reaction = reaction.emoji.name
-
-                # Reaction controls:
-                #   - ⬅ Previous page
-                #   - 👍 Upload current emoji
-                #   - ➡ Next page
-                #   - 🔀 Random page
-                if reaction == "⬅":
-                    if page != 0:
-                        page -= 1
-                elif reaction == "👍":
-                    await ctx.upload_emoji(emoji.name, emoji.url)
-                elif reaction == "➡":
-                    if page != len(emojis) - 1:
-                        page += 1
-                elif reaction == "🔀":
-                    page = randint(0, len(emojis) - 1)
-
-                # Update Embed to reflect new page
-                await sent_msg.remove_reaction(reaction, ctx.author)
-                await browse(emojis, page, existing_msg=sent_msg)
-
-        # Search for results in the emoji cache
-        query = query.lower()
-        search_results = [e for e in self.bot.emojis if query in e.name.lower()]
+        # Search for results in the emoji index
+        search_results = self.bot.search_index.search(query)
 
         if len(search_results) == 0:
             raise Exception("No results. ")
 
-        # Start browsing
-        # Function is recursive
-        await browse(emojis=search_results, page=0)
+        # Reaction controls:
+        #   - ⬅ Previous page
+        #   - 👍 Upload current emoji
+        #   - ➡ Next page
+        #   - 🔀 Random page
+        await Paginator(
+            ctx,
+            len(search_results),
+            render,
+            on_select=upload,
+            prefetch=prefetch,
+            shuffle=True,
+            timeout_embed=Embed(
+                colour=Colours.error,
+                description="%s This search timed out." % CustomEmojis.error,
+            ),
+        ).run()
 
     @command(
         name="link",
@@ -280,18 +346,24 @@ class Utility(Cog):
         :param pack_number: The pack to view.
         """
 
+        packs = self.catalogue.packs
+
+        if not packs:
+            raise Exception("The pack list is still loading. Try again in a moment.")
+
         if not pack_number:
-            await ctx.send(embed=self.packs_embed)
+            pages = self.list_packs()
+            await Paginator(ctx, len(pages), lambda page: pages[page]).run()
             return
 
-        # Pack does not exist
-        try:
-            pack = self.packs[pack_number - 1]
-        except IndexError:
+        # Pack does not exist. Negative numbers would otherwise count back from the end
+        if not 1 <= pack_number <= len(packs):
             raise Exception(
                 "That's not a valid pack. Use `>packs` to see a list of available packs."
             )
 
+        pack = packs[pack_number - 1]
+
         # fields
         embed = (
             Embed(title=pack["name"], description=pack["description"])